@@ -0,0 +1,34 @@
+"""Time the checks of one large merged group, where every attribute access of the checker is on the hot path.
+
+    PYTHONPATH=. python benchmarks/bench_checker_overhead.py [lines]
+"""
+import sys
+import timeit
+
+from flake8_rst.application import Application
+from flake8_rst.checker import RstFileChecker
+from flake8_rst.rst import find_sourcecode
+
+from bench_find_blocks import make_source
+
+
+def main(lines=20000):
+    application = Application()
+    application.initialize(['--no-cache'])
+    options = application.options
+    checks = application.file_checker_manager.checks.to_dictionary()
+
+    blocks = list(find_sourcecode('group.rst', options, make_source(lines)))
+    source_block = max(blocks, key=lambda block: len(block.source_lines))
+
+    def run():
+        checker = RstFileChecker('group.rst', checks, options, style_guide=application.guide,
+                                 source_block=source_block)
+        checker.run_checks()
+
+    timing = min(timeit.repeat(run, number=1, repeat=5))
+    print('{} lines in the group: {:.3f}s'.format(len(source_block.source_lines), timing))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
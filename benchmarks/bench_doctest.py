@@ -0,0 +1,39 @@
+"""Time the extraction of doctest examples from the docstrings of the standard library.
+
+    PYTHONPATH=. python benchmarks/bench_doctest.py [number of modules]
+"""
+import glob
+import io
+import optparse
+import os
+import sys
+import timeit
+
+from flake8_rst.rst import find_sourcecode
+
+OPTIONS = optparse.Values(dict(bootstrap=None, default_groupnames='*.rst->*: default', directive_scanner='regex'))
+
+
+def read_modules(count):
+    sources = []
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.__file__), '*.py'))):
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            src = f.read()
+        if '>>>' in src:
+            sources.append((path, src))
+    return sources[:count]
+
+
+def main(count=100):
+    sources = read_modules(count)
+
+    def extract():
+        return [block for path, src in sources for block in find_sourcecode(path, OPTIONS, src)]
+
+    blocks = extract()
+    print('{} modules with doctests, {} blocks'.format(len(sources), len(blocks)))
+    print('find_sourcecode: {:.3f}s'.format(min(timeit.repeat(extract, number=1, repeat=3))))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
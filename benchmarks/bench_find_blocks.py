@@ -0,0 +1,63 @@
+"""Time ``SourceBlock.find_blocks`` with both directive engines and its line number lookup on a synthetic rst page.
+
+    PYTHONPATH=. python benchmarks/bench_find_blocks.py [number of lines]
+"""
+import bisect
+import sys
+import timeit
+
+from flake8_rst.rst import RST_RE, RST_SCANNER
+from flake8_rst.sourceblock import SourceBlock, _newline_offsets
+
+SECTION = '''Section
+-------
+
+Some text describing the example.
+
+.. code-block:: python
+
+    import os
+
+    print(os.getcwd())
+
+'''
+
+
+# Directives without body followed by many blank lines make RST_RE backtrack over every blank line.
+PATHOLOGICAL_SECTION = '.. code-block:: python\n' + '\n' * 2000 + 'Text without code.\n'
+
+
+def make_source(lines):
+    section_lines = SECTION.count('\n')
+    return SECTION * (lines // section_lines)
+
+
+def line_numbers_by_prefix_count(src, matches):
+    return [src[:match.start()].count('\n') for match in matches]
+
+
+def line_numbers_by_bisect(src, matches):
+    newline_offsets = _newline_offsets(src)
+    return [bisect.bisect_left(newline_offsets, match.start()) for match in matches]
+
+
+def main(lines=50000):
+    src = make_source(lines)
+    source_block = SourceBlock.from_source('', src)
+    matches = list(RST_RE.finditer(src))
+
+    def measure(func, *args):
+        return min(timeit.repeat(lambda: func(*args), number=1, repeat=3))
+
+    print('{} lines, {} blocks'.format(src.count('\n'), len(matches)))
+    print('find_blocks, regex:         {:.3f}s'.format(measure(lambda: list(source_block.find_blocks(RST_RE)))))
+    print('find_blocks, line scanner:  {:.3f}s'.format(measure(lambda: list(source_block.find_blocks(RST_SCANNER)))))
+    pathological = PATHOLOGICAL_SECTION * 20
+    print('pathological page, regex:        {:.3f}s'.format(measure(lambda: list(RST_RE.finditer(pathological)))))
+    print('pathological page, line scanner: {:.3f}s'.format(measure(lambda: list(RST_SCANNER.finditer(pathological)))))
+    print('line numbers, prefix count: {:.3f}s'.format(measure(line_numbers_by_prefix_count, src, matches)))
+    print('line numbers, bisect:       {:.3f}s'.format(measure(line_numbers_by_bisect, src, matches)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,35 @@
+"""Report the peak RSS of a serial flake8-rst run over a generated corpus of rst pages.
+
+    PYTHONPATH=. python benchmarks/bench_memory.py [number of files] [lines per file]
+"""
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from bench_find_blocks import make_source
+
+
+def main(files=200, lines=5000):
+    directory = tempfile.mkdtemp()
+    try:
+        src = make_source(lines)
+        for index in range(files):
+            with open(os.path.join(directory, 'page_{}.rst'.format(index)), 'w') as f:
+                f.write(src)
+
+        subprocess.check_call([sys.executable, '-m', 'flake8_rst', '--no-cache', '--jobs=1', '--exit-zero',
+                               '--filename=*.rst', '--output-file', os.devnull, directory])
+    finally:
+        shutil.rmtree(directory)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024. if sys.platform == 'darwin' else 1024.
+    print('{} files with {} lines: peak RSS {:.1f} MB'.format(files, lines, max_rss / scale))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
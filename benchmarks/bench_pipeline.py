@@ -0,0 +1,86 @@
+"""End-to-end and per-stage benchmark of flake8-rst over a synthetic corpus, see ``corpus.py``.
+
+    PYTHONPATH=. python benchmarks/bench_pipeline.py [pages] [sections per page] [jobs]
+
+Reports throughput and peak RSS of a complete run without cache, and the time spent in reading, extraction with
+cleaning, and checking when the stages run one after the other in this process.
+"""
+import io
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from flake8_rst.application import Application
+from flake8_rst.checker import RstFileChecker
+from flake8_rst.rst import find_sourcecode
+
+from corpus import generate
+
+
+def run_application(directory, jobs):
+    """Run flake8-rst in a subprocess, return the wall time, the number of blocks and the peak RSS in MB."""
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-m', 'flake8_rst', '--no-cache', '--exit-zero', '--benchmark',
+                                      '--jobs={}'.format(jobs), '--filename=*.rst,*.py', directory])
+    elapsed = time.time() - start
+
+    blocks = 0
+    for line in output.decode('utf-8').splitlines():
+        if line.endswith('total blocks processed'):
+            blocks = int(line.split()[0])
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1024 * 1024. if sys.platform == 'darwin' else 1024.
+    return elapsed, blocks, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+
+
+def run_stages(paths):
+    application = Application()
+    application.initialize(['--no-cache'])
+    options = application.options
+    checks = application.file_checker_manager.checks.to_dictionary()
+    timings = []
+
+    start = time.time()
+    sources = []
+    for path in paths:
+        with io.open(path, encoding='utf-8') as f:
+            sources.append((path, f.read()))
+    timings.append(('read', time.time() - start))
+
+    start = time.time()
+    blocks = [(path, block) for path, src in sources for block in find_sourcecode(path, options, src)]
+    for _, block in blocks:
+        block.clean()
+    timings.append(('extract and clean', time.time() - start))
+
+    start = time.time()
+    for path, block in blocks:
+        RstFileChecker(path, checks, options, source_block=block).run_checks()
+    timings.append(('check', time.time() - start))
+    return timings
+
+
+def main(pages=100, sections=50, jobs=1):
+    directory = tempfile.mkdtemp()
+    try:
+        paths = generate(directory, pages, sections)
+        size = sum(os.path.getsize(path) for path in paths) / 1024. / 1024.
+
+        elapsed, blocks, max_rss = run_application(directory, jobs)
+        print('{} files, {:.1f} MB, {} blocks, --jobs={}'.format(len(paths), size, blocks, jobs))
+        print('end to end:  {:.2f}s, {:.0f} blocks/s, {:.2f} MB/s, peak RSS {:.1f} MB'.format(
+            elapsed, blocks / elapsed, size / elapsed, max_rss))
+
+        for stage, timing in run_stages(paths):
+            print('{:<18} {:.2f}s'.format(stage + ':', timing))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,39 @@
+"""Compare the memory of the line store of merged ``default`` groups with a list of tuples per line.
+
+The strings are shared by both representations, so only the containers are measured.
+
+    PYTHONPATH=. python benchmarks/bench_source_lines.py [number of lines]
+"""
+import optparse
+import sys
+import tracemalloc
+
+from bench_find_blocks import make_source
+from flake8_rst.rst import find_sourcecode
+from flake8_rst.sourceblock import SourceLines
+
+OPTIONS = optparse.Values(dict(bootstrap=None, default_groupnames='*.rst->*: default', directive_scanner='regex'))
+
+
+def traced(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main(lines=300000):
+    src = make_source(lines)
+    blocks = list(find_sourcecode('page.rst', OPTIONS, src))
+    _, columns_size = traced(lambda: [SourceLines.concat([block.source_lines]) for block in blocks])
+    _, tuples_size = traced(lambda: [list(block.source_lines) for block in blocks])
+
+    print('{} lines, {} merged lines'.format(src.count('\n'), sum(len(block.source_lines) for block in blocks)))
+    print('SourceLines:                  {:.2f} MB'.format(columns_size / 1024 / 1024.))
+    print('(lineno, source, raw) tuples: {:.2f} MB'.format(tuples_size / 1024 / 1024.))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,42 @@
+"""Time a complete flake8-rst run on a small rst file, as editor hooks invoke it.
+
+    PYTHONPATH=. python benchmarks/bench_startup.py [number of runs]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+DOCUMENT = '''Example
+=======
+
+.. code-block:: python
+
+    import os
+
+    print(os.getcwd())
+'''
+
+
+def run(*args):
+    return subprocess.check_output((sys.executable,) + args, stderr=subprocess.STDOUT).decode('utf-8')
+
+
+def main(runs=10):
+    imports_ipython = run('-c', 'import sys, flake8_rst.checker; print("IPython" in sys.modules)').strip()
+    print('importing flake8_rst.checker loads IPython: {}'.format(imports_ipython))
+
+    with tempfile.NamedTemporaryFile('w', suffix='.rst', delete=False) as f:
+        f.write(DOCUMENT)
+    try:
+        duration = min(timeit.repeat(lambda: run('-m', 'flake8_rst', '--no-cache', '--exit-zero', f.name),
+                                     number=1, repeat=runs))
+    finally:
+        os.remove(f.name)
+
+    print('flake8-rst on a single file: {:.3f}s'.format(duration))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
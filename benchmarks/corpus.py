@@ -0,0 +1,102 @@
+"""Generate a synthetic documentation corpus: rst pages and python modules with every kind of block flake8-rst handles.
+
+    PYTHONPATH=. python benchmarks/corpus.py DIRECTORY [pages] [sections per page] [seed]
+
+The corpus only depends on its arguments, so runs on the same arguments check the same blocks.
+"""
+import os
+import random
+import sys
+
+TEXT = 'Some text describing the example, with a ``literal`` and a :func:`reference`.\n\n'
+
+SNIPPETS = [
+    'import os\n\nprint(os.getcwd())\n',
+    'import sys\n\n\ndef main(argv):\n    return len(argv)\n\n\nmain(sys.argv)\n',
+    'values = [value ** 2 for value in range(10)]\ntotal = sum(values)\n',
+    'import collections\ncounter = collections.Counter("abracadabra")\n',
+    'class Example(object):\n    def __init__(self, value):\n        self.value = value\n',
+    'result = {key: value for key, value in zip("abc", range(3))}\nunused = 1;\n',
+    'x = 1\nif x == 1 :\n    print( x )\n',
+    'long_line = "{}"\n'.format('x' * 100),
+]
+
+IPYTHON_SNIPPETS = [
+    'In [1]: import numpy as np\n\nIn [2]: np.arange(10)\n',
+    'In [1]: %timeit sum(range(100))\n\nIn [2]: !ls\n',
+    '@savefig plot.png\nIn [1]: plot([1, 2, 3])\n',
+]
+
+
+def _indent(code, indent='    '):
+    return ''.join(indent + line if line.strip() else line for line in code.splitlines(True))
+
+
+def _doctest(code):
+    lines = code.splitlines(True)
+    return ''.join(('... ' if line.startswith((' ', ')')) else '>>> ') + line for line in lines if line.strip())
+
+
+def _roles(rng):
+    roles = []
+    choice = rng.random()
+    if choice < 0.1:
+        roles.append(':flake8-group: Ignore')
+    elif choice < 0.3:
+        roles.append(':flake8-group: None')
+    elif choice < 0.4:
+        roles.append(':flake8-group: group-{}'.format(rng.randint(1, 3)))
+    if rng.random() < 0.1:
+        roles.append(':flake8-bootstrap: import os; import sys')
+    if rng.random() < 0.2:
+        roles.append(':flake8-add-ignore: F401, E231')
+    return roles
+
+
+def make_section(rng):
+    kind = rng.choice(['code-block', 'code-block', 'sourcecode', 'ipython', 'pycon'])
+    if kind == 'ipython':
+        directive, code = '.. ipython:: python', rng.choice(IPYTHON_SNIPPETS)
+    elif kind == 'pycon':
+        directive, code = '.. code-block:: pycon', _doctest(rng.choice(SNIPPETS))
+    else:
+        directive, code = '.. {}:: python'.format(kind), rng.choice(SNIPPETS)
+
+    header = directive + '\n' + ''.join('    {}\n'.format(role) for role in _roles(rng))
+    return 'Section\n-------\n\n' + TEXT + header + '\n' + _indent(code) + '\n'
+
+
+def make_page(rng, sections):
+    return 'Title\n=====\n\n' + ''.join(make_section(rng) for _ in range(sections))
+
+
+def make_module(rng, functions):
+    parts = ['"""Module with doctests.\n\n{}"""\n'.format(_doctest(rng.choice(SNIPPETS)))]
+    for index in range(functions):
+        parts.append('\n\ndef function_{}(value):\n    """Return the value.\n\n{}\n    """\n    return value\n'.format(
+            index, _indent(_doctest(rng.choice(SNIPPETS)))))
+    return ''.join(parts)
+
+
+def generate(directory, pages=100, sections=50, seed=0):
+    """Write ``pages`` rst pages and a python module for every fourth page into ``directory``, return the paths."""
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    paths = []
+    for index in range(pages):
+        files = [('page_{}.rst'.format(index), make_page(rng, sections))]
+        if index % 4 == 0:
+            files.append(('module_{}.py'.format(index), make_module(rng, sections // 2)))
+        for name, src in files:
+            path = os.path.join(directory, name)
+            with open(path, 'w') as f:
+                f.write(src)
+            paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    paths = generate(sys.argv[1], *map(int, sys.argv[2:]))
+    print('{} files, {:.1f} MB'.format(len(paths), sum(os.path.getsize(path) for path in paths) / 1024. / 1024.))
@@ -1,4 +1,5 @@
 import argparse
+import json
 import time
 
 from flake8.main import options
@@ -6,7 +7,11 @@ from flake8.main.application import Application as Flake8Application
 from flake8.options import manager
 
 from . import __version__
+from . import cache
 from . import checker
+from . import server
+from . import vcs
+from .client import DEFAULT_SOCKET
 
 
 class Application(Flake8Application):
@@ -48,6 +53,93 @@ class Application(Flake8Application):
             '--default-groupnames', default="*.rst->*: default", parse_from_config=True,
             help='Set default group names.', type='string',
         )
+        self.option_manager.add_option(
+            '--directive-scanner', default='regex', parse_from_config=True, choices=['regex', 'line'],
+            help='Engine to find directives in rst: "regex" or the line based "line" scanner.',
+        )
+        self.option_manager.add_option(
+            '--ignored-lines-regex', default='', parse_from_config=True, metavar='REGEX',
+            help='Also drop lines starting with a match of REGEX from blocks; one pattern per line in config files.',
+        )
+        self.option_manager.add_option(
+            '--since', default=None, metavar='REF',
+            help='Check only files changed since the git REF, and in those the blocks and groups with changed lines.',
+        )
+        self.option_manager.add_option(
+            '--profile-blocks', default=0, metavar='N', type='int',
+            help='Report the time spent per stage and the N slowest blocks.',
+        )
+        self.option_manager.add_option(
+            '--trace-file', default=None, metavar='FILE',
+            help='Write the stages of the run as Chrome trace events to FILE, for chrome://tracing or Perfetto.',
+        )
+        self.option_manager.add_option(
+            '--serve', default=False, action='store_true',
+            help='Keep plugins, options and caches loaded and check files for clients connecting to --socket.',
+        )
+        self.option_manager.add_option(
+            '--client', default=False, action='store_true',
+            help='Let the server on --socket check the given paths, or check them here if none is listening.',
+        )
+        self.option_manager.add_option(
+            '--socket', default=DEFAULT_SOCKET,
+            help='Unix socket of --serve and --client; clients look for it in parent directories too.', type='string',
+        )
+        self.option_manager.add_option(
+            '--no-cache', default=False, action='store_true', parse_from_config=True,
+            help='Check every block instead of reusing results from the cache.',
+        )
+        self.option_manager.add_option(
+            '--cache-dir', default=cache.default_cache_dir(), parse_from_config=True,
+            help='Directory of the results cache.', type='string',
+        )
+        self.option_manager.add_option(
+            '--cache-size', default=100, parse_from_config=True,
+            help='Maximal size of the results cache in megabytes.', type='int',
+        )
+
+    def _run(self, argv):
+        self.initialize(argv)
+        if self.options.serve:
+            server.Server(self).serve_forever()
+            return
+
+        self.run_checks()
+        self.report()
+
+    def report(self):
+        self.formatter.start()
+        self.report_errors()
+        self.report_statistics()
+        self.report_benchmarks()
+        self.report_profile()
+        self.formatter.stop()
+        self.write_trace()
+
+    def report_profile(self):
+        if not self.options.profile_blocks:
+            return
+
+        for line in self.file_checker_manager.profiler.summary(self.options.profile_blocks):
+            self.formatter._write(line)
+
+    def write_trace(self):
+        if not self.options.trace_file:
+            return
+
+        with open(self.options.trace_file, 'w') as f:
+            json.dump(self.file_checker_manager.profiler.trace(), f)
+
+    def report_benchmarks(self):
+        super(Application, self).report_benchmarks()
+        if not self.options.benchmark:
+            return
+
+        statistics = self.file_checker_manager.statistics
+        self.formatter.show_benchmarks([
+            ('total blocks processed', statistics['blocks']),
+            ('blocks transformed by IPython', statistics['ipython blocks']),
+        ])
 
     def make_file_checker_manager(self):
         if self.file_checker_manager is None:
@@ -56,3 +148,13 @@ class Application(Flake8Application):
                 arguments=self.args,
                 checker_plugins=self.check_plugins,
             )
+            if self.running_against_diff:
+                self.file_checker_manager.changed_lines = self.parsed_diff
+            elif self.options.since is not None:
+                self.file_checker_manager.changed_lines = vcs.changed_lines_since(
+                    self.options.since, self.options.filename, self.args)
+
+    def run_checks(self, files=None):
+        if self.options.since is not None:
+            files = sorted(self.file_checker_manager.changed_lines)
+        super(Application, self).run_checks(files)
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+
+from . import __version__
+from .sourceblock import SOURCE, RAW, _ipython_version, _to_bytes
+
+LOG = logging.getLogger(__name__)
+
+# Options which only control what is run or how results are shown; they never change the results of a block.
+RUN_OPTIONS = {
+    '_running_from_vcs', 'append_config', 'benchmark', 'bug_report', 'cache_dir', 'cache_size', 'client', 'config',
+    'count', 'diff', 'exclude', 'exit_zero', 'extend_exclude', 'filename', 'filenames', 'format', 'install_hook',
+    'isolated', 'jobs', 'no_cache', 'output_file', 'profile_blocks', 'quiet', 'serve', 'show_source', 'since', 'socket',
+    'statistics', 'stdin_display_name', 'tee', 'trace_file', 'verbose',
+}
+
+_replace = getattr(os, 'replace', os.rename)
+
+# Entries live in a subdirectory of --cache-dir, tagged as a cache directory. Pruning only removes files named like
+# the entries written here, so pointing --cache-dir at a shared directory never deletes other files.
+ENTRIES_DIR = 'entries'
+CACHEDIR_TAG = 'CACHEDIR.TAG'
+CACHEDIR_TAG_CONTENT = ('Signature: 8a477f597d28d172789f06886806bc55\n'
+                        '# This file is a cache directory tag created by flake8-rst.\n')
+_ENTRY_RE = re.compile(r'^(?:file-|ipython-)?[0-9a-f]{40}(?:\.\d+\.tmp)?$')
+
+
+def default_cache_dir():
+    """Return the cache directory of the user, outside of any checkout which could bring its own entries."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'flake8-rst')
+
+
+def _stable_repr(value):
+    # Several option lists are built from sets, their order changes between runs.
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return repr(sorted(_stable_repr(item) for item in value))
+    return repr(value)
+
+
+def options_fingerprint(options, plugin_versions):
+    """Describe everything besides the block itself which influences the results of a check."""
+    values = sorted((key, _stable_repr(value)) for key, value in vars(options).items() if key not in RUN_OPTIONS)
+    # Blocks are keyed before cleaning, which depends on the IPython version.
+    return repr((__version__, platform.python_version(), _ipython_version(), sorted(plugin_versions), values))
+
+
+class ResultCache(object):
+    """On-disk cache of block results, keyed by the block content and the options fingerprint.
+
+    Blocks are keyed before they are cleaned, so a hit spares the cleaning as well. Results are stored relative to
+    the uncleaned block lines, so a block which only moved within its file is still served from the cache. Every
+    entry is a JSON file of its own, which makes the cache safe to share between worker processes.
+    """
+
+    def __init__(self, directory, fingerprint, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.entries = os.path.join(directory, ENTRIES_DIR)
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+
+    def key(self, source_block):
+        digest = hashlib.sha1(self.fingerprint.encode('utf-8'))
+        digest.update(repr(sorted(source_block.roles.items())).encode('utf-8'))
+        for line in source_block.boot_lines + source_block.source_lines:
+            digest.update(repr((line[SOURCE], line[RAW])).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.entries, key)
+
+    def _read(self, key):
+        # Entries are plain JSON: the cache directory may come from elsewhere, reading it must not run any code.
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return value
+
+    def _write(self, key, value):
+        path = self._path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.entries):
+                os.makedirs(self.entries)
+                with open(os.path.join(self.entries, CACHEDIR_TAG), 'w') as f:
+                    f.write(CACHEDIR_TAG_CONTENT)
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+            _replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            LOG.warning('Could not write cache entry %s: %s', path, e)
+
+    def get(self, key):
+        return self._read(key)
+
+    def set(self, key, value):
+        self._write(key, value)
+
+    def restore(self, checker, value):
+        """Fill results and statistics of ``checker`` from the cached ``value`` of its block."""
+        results, statistics = value
+        raw_linenos = checker.source_block.raw_linenos
+        checker.results = [(error_code, raw_linenos[index], column, text, source)
+                           for error_code, index, column, text, source in results]
+        checker.statistics = statistics
+
+    def save(self, checker, key):
+        positions = {lineno: index for index, lineno in enumerate(checker.source_block.raw_linenos)}
+        try:
+            results = [(error_code, positions[lineno], column, text, source)
+                       for error_code, lineno, column, text, source in checker.results]
+        except KeyError:
+            return
+
+        self._write(key, (results, checker.statistics))
+
+    def manifest(self, filename):
+        """Return the :class:`FileManifest` of ``filename``, ``None`` if the file can't be tracked."""
+        if filename == '-':
+            return None
+        digest = hashlib.sha1(self.fingerprint.encode('utf-8'))
+        digest.update(_to_bytes(os.path.abspath(filename)))
+        try:
+            return FileManifest(self, 'file-' + digest.hexdigest(), filename)
+        except OSError:
+            return None
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits into ``max_size`` bytes.
+
+        Every written entry, of any process, changes the modification time of the directory. The tag is touched after
+        pruning, so runs which only read from the cache don't list the entries at all.
+        """
+        tag = os.path.join(self.entries, CACHEDIR_TAG)
+        try:
+            if os.stat(self.entries).st_mtime <= os.stat(tag).st_mtime:
+                return
+            names = os.listdir(self.entries)
+        except OSError:
+            return
+
+        entries = []
+        for name in names:
+            if not _ENTRY_RE.match(name):
+                continue
+            try:
+                stat = os.stat(self._path(name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                continue
+            total -= size
+
+        try:
+            os.utime(tag, None)
+        except OSError:
+            pass
+
+
+class FileManifest(object):
+    """Final results of the blocks of a single file.
+
+    Every block is stored as its roles, the line numbers it spans in the file and its results. The entry is valid
+    while size and modification time of the file are unchanged, which spares reading the file at all. Otherwise the
+    content hash decides, so a file which was only touched is still served from the cache.
+    """
+
+    def __init__(self, cache, key, filename):
+        stat = os.stat(filename)
+        self.cache = cache
+        self.key = key
+        self.stamp = [stat.st_size, stat.st_mtime]
+        self.entry = cache._read(key)
+
+    @staticmethod
+    def _digest(src):
+        return hashlib.sha1(_to_bytes(src)).hexdigest()
+
+    @staticmethod
+    def _blocks(blocks):
+        # JSON turns tuples into lists, the checkers and the report expect tuples again.
+        return [(tuple((role, tuple(codes)) for role, codes in roles_key), linenos,
+                 [tuple(result) for result in results], statistics)
+                for roles_key, linenos, results, statistics in blocks]
+
+    def blocks(self, src=None):
+        """Return the stored ``(roles_key, linenos, results, statistics)`` tuples if the file is unchanged."""
+        if self.entry is None:
+            return None
+
+        stamp, digest, blocks = self.entry
+        if stamp == self.stamp:
+            return self._blocks(blocks)
+        if src is not None and digest == self._digest(src):
+            self.cache._write(self.key, [self.stamp, digest, blocks])
+            return self._blocks(blocks)
+        return None
+
+    def save(self, src, checkers):
+        blocks = [(checker.roles_key, list(checker.source_block.raw_linenos), checker.results, checker.statistics)
+                  for checker in checkers]
+        self.cache._write(self.key, [self.stamp, self._digest(src), blocks])
@@ -1,36 +1,249 @@
 import optparse
+import re
 
-from flake8.checker import FileChecker, Manager, LOG
+from flake8.checker import FileChecker, Manager, LOG, _try_initialize_processpool, calculate_pool_chunksize
 from flake8.processor import FileProcessor
 from flake8.style_guide import DecisionEngine
-from flake8 import exceptions
+from flake8 import defaults, exceptions, utils
 
+from . import profiling
+from .cache import ResultCache, options_fingerprint
 from .rst import find_sourcecode
+from .sourceblock import ignored_lines_re, transform_memo
 
 ROLES = ['set-ignore', 'set-select', 'add-ignore', 'add-select']
 
 
+def _restore_checkers(filename, checks, options, blocks, changed_lines=None):
+    interner = OptionsInterner.for_options(options)
+    checkers = []
+    for key, linenos, results, statistics in blocks:
+        if changed_lines is not None and changed_lines.isdisjoint(linenos):
+            continue
+        checker = RstFileChecker(filename, checks, options, interner=interner)
+        checker.roles_key = key
+        checker.options = interner.options(key)
+        checker.results = results
+        checker.statistics = dict(statistics, **{'ipython blocks': 0})
+        checker.release()
+        checkers.append(checker)
+    return checkers
+
+
+def _check_file(args):
+    """Extract the blocks of one file and check them, all within the calling process.
+
+    With ``changed_lines`` only blocks and groups containing one of those lines are checked. Returns the checkers and
+    the :class:`~flake8_rst.profiling.Profiler` of the file, ``None`` without ``--profile-blocks``.
+    """
+    filename, checks, options, cache, changed_lines = args
+    profiler = profiling.make_profiler(options)
+    profiling.current = profiler or profiling.NULL_PROFILER
+    try:
+        with profiling.current.measure('file', name=filename):
+            checkers = _check_blocks(filename, checks, options, cache, changed_lines, profiling.current)
+    finally:
+        profiling.current = profiling.NULL_PROFILER
+    return checkers, profiler
+
+
+def _check_blocks(filename, checks, options, cache, changed_lines, profiler):
+    transform_memo.store = cache
+    with profiler.measure('read'):
+        manifest = cache.manifest(filename) if cache is not None else None
+        blocks = manifest.blocks() if manifest is not None else None
+    if blocks is not None:
+        return _restore_checkers(filename, checks, options, blocks, changed_lines)
+
+    with profiler.measure('read', args={'filename': filename}):
+        file_checker = FileChecker(filename, checks, options)
+    if not file_checker.should_process:
+        return []
+
+    src = ''.join(file_checker.processor.lines)
+    blocks = manifest.blocks(src) if manifest is not None else None
+    if blocks is not None:
+        return _restore_checkers(filename, checks, options, blocks, changed_lines)
+
+    interner = OptionsInterner.for_options(options)
+    checker_class = TracedRstFileChecker if options.trace_file else RstFileChecker
+    checkers = []
+    source_blocks = iter(find_sourcecode(filename, options, src, changed_lines=changed_lines))
+    while True:
+        with profiler.measure('extract'):
+            source_block = next(source_blocks, None)
+        if source_block is None:
+            break
+
+        timings = profiler.add_block(filename, source_block)
+        args = {'block': '{}:{}'.format(filename, source_block.start_line_number)}
+        with profiler.measure('setup', timings, args=args):
+            key = cache.key(source_block) if cache is not None else None
+            cached = cache.get(key) if cache is not None else None
+            checker = checker_class.from_sourcecode(
+                filename=filename, checks=checks, options=options, style_guide=None, source_block=source_block,
+                interner=interner, clean=cached is None
+            )
+        checker.timings = timings
+        with profiler.measure('check', timings, args=args):
+            if cached is not None:
+                cache.restore(checker, cached)
+            else:
+                checker.run_checks()
+                if cache is not None:
+                    cache.save(checker, key)
+        checker.statistics['ipython blocks'] = source_block.ipython_transforms
+        checkers.append(checker)
+
+    # The manifest holds all blocks of a file, it can't be written from a subset.
+    if manifest is not None and changed_lines is None:
+        manifest.save(src, checkers)
+    for checker in checkers:
+        checker.release()
+    return checkers
+
+
 class RstManager(Manager):
 
-    def _job_count(self):
-        return 0
+    def __init__(self, *args, **kwargs):
+        super(RstManager, self).__init__(*args, **kwargs)
+        self.filenames = []
+        self.changed_lines = None
+        self.profiler = profiling.make_profiler(self.options)
+        self._interners = {}
+        self.statistics.update({'blocks': 0, 'ipython blocks': 0})
+        try:
+            ignored_lines_re(self.options.ignored_lines_regex)
+        except re.error as e:
+            raise exceptions.ExecutionError('Invalid --ignored-lines-regex {!r}: {}'.format(
+                self.options.ignored_lines_regex, e))
+
+        self.cache = None
+        if not self.options.no_cache:
+            fingerprint = options_fingerprint(self.options, self.checks.manager.versions())
+            self.cache = ResultCache(self.options.cache_dir, fingerprint, self.options.cache_size * 1024 * 1024)
 
     def make_checkers(self, paths=None):
-        super(RstManager, self).make_checkers(paths)
-        checkers = []
+        """Collect the files to check; reading, extraction and checking are left to ``run``."""
+        if paths is None:
+            paths = self.arguments
+
+        if not paths and self.changed_lines is None:
+            paths = ['.']
+
+        filename_patterns = self.options.filename
+        explicitly_provided = not self.options._running_from_vcs and not self.options.diff
+
+        self.filenames = [
+            filename
+            for argument in paths
+            for filename in utils.filenames_from(argument, self.is_path_excluded)
+            if filename == '-' or (explicitly_provided and argument == filename)
+            or utils.fnmatch(filename, filename_patterns)
+        ]
+
+        LOG.info('Checking %d files', len(self.filenames))
+
+    def _process_statistics(self):
         for checker in self.checkers:
-            src = ''.join(checker.processor.read_lines())
-            for i, source_block in enumerate(find_sourcecode(checker.filename, checker.options, src)):
-                checker = RstFileChecker.from_sourcecode(
-                    filename=checker.filename, checks=checker.checks, options=self.options,
-                    style_guide=self.style_guide, source_block=source_block
-                )
-                checkers.append(checker)
+            for statistic in defaults.STATISTIC_NAMES:
+                self.statistics[statistic] += checker.statistics[statistic]
+            self.statistics['ipython blocks'] += checker.statistics.get('ipython blocks', 0)
+        self.statistics['blocks'] += len(self.checkers)
+        self.statistics['files'] += len(self.filenames)
+
+    def _changed_lines_of(self, filename):
+        if self.changed_lines is None:
+            return None
+        return self.changed_lines.get(filename)
+
+    def _style_guide_for(self, filename):
+        # flake8 < 3.7 has a single style guide without per-file-ignores.
+        style_guide_for = getattr(self.style_guide, 'style_guide_for', None)
+        return style_guide_for(filename) if style_guide_for else self.style_guide
+
+    def _decider_for(self, guide, roles_key):
+        if not roles_key:
+            return guide.decider
+        if guide not in self._interners:
+            self._interners[guide] = OptionsInterner(guide.options)
+        return self._interners[guide].decider(roles_key)
+
+    def report(self):
+        """Report the results of every block, decided upon with the options its roles call for.
+
+        While the results of a block are handled, the style guide of its file decides with an engine which applies the
+        roles of the block on top of the options of that style guide.
+        """
+        results_reported = results_found = 0
+        profiler = self.profiler or profiling.NULL_PROFILER
+        for checker in self._all_checkers:
+            with profiler.measure('report', checker.timings, args={'filename': checker.display_name}):
+                results = sorted(checker.results, key=lambda tup: (tup[1], tup[2]))
+                filename = checker.display_name
+                guide = self._style_guide_for(filename)
+                decider = guide.decider
+                guide.decider = self._decider_for(guide, checker.roles_key)
+                try:
+                    with self.style_guide.processing_file(filename):
+                        results_reported += self._handle_results(filename, results)
+                finally:
+                    guide.decider = decider
+            results_found += len(results)
+        return results_found, results_reported
+
+    def _map(self, func, items):
+        """Apply ``func`` to every item, in worker processes when ``--jobs`` allows it.
+
+        Results are returned in the order of ``items`` to keep the output deterministic.
+        """
+        pool = None
+        if self.jobs > 1 and len(items) > 1:
+            pool = _try_initialize_processpool(self.jobs)
+
+        if pool is None:
+            return [func(item) for item in items]
+
+        pool_closed = False
+        try:
+            results = list(pool.imap(func, items, chunksize=calculate_pool_chunksize(len(items), self.jobs)))
+            pool.close()
+            pool.join()
+            pool_closed = True
+        finally:
+            if not pool_closed:
+                pool.terminate()
+                pool.join()
+        return results
+
+    def run(self):
+        checks = self.checks.to_dictionary()
+        try:
+            results = self._map(_check_file, [
+                (filename, checks, self.options, self.cache, self._changed_lines_of(filename))
+                for filename in self.filenames
+            ])
+        except KeyboardInterrupt:
+            LOG.warning('Flake8 was interrupted by the user')
+            raise exceptions.EarlyQuit('Early quit while running checks')
+
+        interner = OptionsInterner(self.options)
+        checkers = []
+        for file_checkers, profiler in results:
+            checkers.extend(file_checkers)
+            if profiler is not None:
+                self.profiler.merge(profiler)
+        for checker in checkers:
+            checker.style_guide = self.style_guide
+            checker.options = interner.options(checker.roles_key)
 
         self.checkers = checkers
         self._all_checkers = checkers
 
-        LOG.info('Checking %d blocks', len(self.checkers))
+        if self.cache is not None:
+            self.cache.prune()
+
+        LOG.info('Checked %d blocks', len(self.checkers))
 
 
 def inject_options(roles, options):
@@ -49,26 +262,89 @@ def inject_options(roles, options):
     return new_options
 
 
+def roles_key(roles):
+    """Normalize the option roles of a block, blocks with equal keys are checked with equal options."""
+    return tuple((role, tuple(sorted({value.strip() for value in roles[role].split(',')})))
+                 for role in ROLES if role in roles)
+
+
+class OptionsInterner(object):
+    """Effective options and decision engines shared by all blocks with the same roles.
+
+    Most blocks of a project carry equal roles, so instead of a copy of the options and a cold DecisionEngine per
+    block they share one of each, and the decision cache of the engine warms up across blocks.
+    """
+    _last = None
+
+    def __init__(self, options):
+        self.base_options = options
+        self._options = {}
+        self._deciders = {}
+
+    @classmethod
+    def for_options(cls, options):
+        """Reuse the interner of the previous file as long as the base options are the same object."""
+        interner = cls._last
+        if interner is None or interner.base_options is not options:
+            interner = cls._last = cls(options)
+        return interner
+
+    def options(self, key):
+        try:
+            return self._options[key]
+        except KeyError:
+            roles = {role: ', '.join(values) for role, values in key}
+            options = self._options[key] = inject_options(roles, self.base_options) if key else self.base_options
+            return options
+
+    def decider(self, key):
+        try:
+            return self._deciders[key]
+        except KeyError:
+            decider = self._deciders[key] = DecisionEngine(self.options(key))
+            return decider
+
+
 class RstFileChecker(FileChecker):
-    def __init__(self, filename, checks, options, style_guide=None, source_block=None):
+    def __init__(self, filename, checks, options, style_guide=None, source_block=None, interner=None):
         self.style_guide = style_guide
         self.source_block = source_block
+        self.roles_key = roles_key(source_block.roles) if source_block else ()
+        self.timings = None
+        self._noqa_lines = None
 
-        if source_block:
-            options = inject_options(source_block.roles, options)
-
-        if self.style_guide:
-            self.decider = DecisionEngine(options)
+        if interner is None:
+            interner = OptionsInterner(options)
+        options = interner.options(self.roles_key)
 
         super(RstFileChecker, self).__init__(filename, checks, options)
 
     @classmethod
-    def from_sourcecode(cls, style_guide, source_block, **kwargs):
-        return RstFileChecker(style_guide=style_guide, source_block=source_block, **kwargs)
+    def from_sourcecode(cls, style_guide, source_block, clean=True, **kwargs):
+        # Extracted blocks are only cleaned once they are checked, restored results don't need cleaned lines.
+        if clean:
+            source_block.clean(ignored_lines_re(kwargs['options'].ignored_lines_regex))
+        return cls(style_guide=style_guide, source_block=source_block, **kwargs)
 
     def _make_processor(self):
-        content = self.source_block.complete_block if self.source_block else ''
-        return FileProcessor(self.filename, self.options, lines=content.splitlines(True))
+        # Every entry of the block lines is exactly one line of code, the processor gets a copy as it may modify them.
+        lines = list(self.source_block.all_lines.sources) if self.source_block else []
+        return FileProcessor(self.filename, self.options, lines=lines)
+
+    def _noqa_line_for(self, line_number, line):
+        """Return the line to look for ``noqa`` comments in, trying to tokenize the block at most once."""
+        if self._noqa_lines is None:
+            try:
+                self.processor.file_tokens
+            except exceptions.InvalidSyntax:
+                self._noqa_lines = False
+            else:
+                self._noqa_lines = True
+
+        if not self._noqa_lines:
+            return line['source']
+        # The processor keeps the mapping of the tokenized block.
+        return self.processor.noqa_line_for(line_number)
 
     def report(self, error_code, line_number, column, text, line=None):
         try:
@@ -82,11 +358,7 @@ class RstFileChecker(FileChecker):
             # If we're recovering from a problem in _make_processor, we will not
             # have this attribute.
             if hasattr(self, "processor"):
-                try:
-                    self.processor.file_tokens
-                    source = self.processor.noqa_line_for(line_number)
-                except exceptions.InvalidSyntax:
-                    source = line['source']
+                source = self._noqa_line_for(line_number, line)
             else:
                 source = None
 
@@ -98,7 +370,41 @@ class RstFileChecker(FileChecker):
         except IndexError:
             return error_code
 
-    def __getattribute__(self, name):
-        if name == 'results' and self.style_guide:
-            self.style_guide.decider = self.decider
-        return super(RstFileChecker, self).__getattribute__(name)
+    def release(self):
+        """Drop the block and its token state once the results are known, only those are needed for the report."""
+        self.source_block = None
+        self.processor = None
+
+    def __getstate__(self):
+        # The style guide holds the output streams and is attached again by the manager.
+        state = self.__dict__.copy()
+        state['style_guide'] = None
+        return state
+
+
+class TracedRstFileChecker(RstFileChecker):
+    """Checker which measures the token based checks and every AST plugin on its own, used for ``--trace-file``."""
+
+    def process_tokens(self):
+        with profiling.current.measure('check', self.timings, name='logical and physical lines'):
+            super(TracedRstFileChecker, self).process_tokens()
+
+    def run_ast_checks(self):
+        # Same as FileChecker.run_ast_checks, with a measurement around each plugin and the parser.
+        with profiling.current.measure('check', self.timings, name='build ast'):
+            try:
+                ast = self.processor.build_ast()
+            except (ValueError, SyntaxError, TypeError) as e:
+                row, column = self._extract_syntax_information(e)
+                self.report("E999", row, column, "%s: %s" % (type(e).__name__, e.args[0]))
+                return
+
+        for plugin in self.checks["ast_plugins"]:
+            with profiling.current.measure('check', self.timings, name=plugin['name']):
+                checker = self.run_check(plugin, tree=ast)
+                try:
+                    runner = checker.run()
+                except AttributeError:
+                    runner = checker
+                for (line_number, offset, text, _) in runner:
+                    self.report(error_code=None, line_number=line_number, column=offset, text=text)
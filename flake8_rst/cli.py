@@ -1,5 +1,7 @@
 """Command-line implementation of flake8."""
-from flake8_rst import application
+import sys
+
+from flake8_rst import client
 
 
 def main(argv=None):
@@ -12,6 +14,19 @@ def main(argv=None):
     :param list argv:
         The arguments to be passed to the application for parsing.
     """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # The client answers without importing flake8, it falls back to a local run without a server.
+    arguments = client.parse_arguments(argv) if '--client' in argv else None
+    response = client.request(*arguments) if arguments is not None else None
+    if response is not None:
+        output, exit_code = response
+        sys.stdout.write(output)
+        raise SystemExit(exit_code)
+
+    from flake8_rst import application
+
     app = application.Application()
     app.run(argv)
     app.exit()
@@ -0,0 +1,84 @@
+"""Thin client of ``flake8-rst --serve``, kept free of flake8 imports so it starts quickly."""
+import io
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = '.flake8-rst.sock'
+
+
+def find_socket(directory=None):
+    """Return the nearest :data:`DEFAULT_SOCKET` in ``directory`` or its parents, up to the root of the checkout.
+
+    A server started in the project root thereby serves clients started in any of its subdirectories.
+    """
+    directory = os.path.abspath(directory or os.getcwd())
+    while True:
+        path = os.path.join(directory, DEFAULT_SOCKET)
+        if os.path.exists(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory or os.path.exists(os.path.join(directory, '.git')):
+            return None
+        directory = parent
+
+
+def parse_arguments(argv):
+    """Return the socket path and the paths to check, ``None`` if ``argv`` holds options the server can't honour."""
+    socket_path = None
+    paths = []
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument == '--client':
+            continue
+        elif argument == '--socket':
+            socket_path = next(arguments, socket_path)
+        elif argument.startswith('--socket='):
+            socket_path = argument.split('=', 1)[1]
+        elif argument.startswith('-') and argument != '-':
+            return None
+        else:
+            paths.append(argument)
+    return socket_path or find_socket() or DEFAULT_SOCKET, paths
+
+
+def _receive(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def request(socket_path, paths):
+    """Let the server check ``paths``, return its ``(output, exit_code)`` or ``None`` if no server answered.
+
+    ``-`` among the paths sends the content of stdin along.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (IOError, OSError):
+        connection.close()
+        return None
+
+    message = {'cwd': os.getcwd(), 'paths': paths}
+    if '-' in paths:
+        message['stdin'] = sys.stdin.read()
+
+    try:
+        connection.sendall(json.dumps(message).encode('utf-8'))
+        connection.shutdown(socket.SHUT_WR)
+        response = json.loads(_receive(connection).decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        # The server went away before answering, the local run needs the stdin read for it.
+        if 'stdin' in message:
+            stdin = message['stdin']
+            stdin = stdin if isinstance(stdin, bytes) else stdin.encode('utf-8')
+            sys.stdin = io.TextIOWrapper(io.BytesIO(stdin), encoding='utf-8')
+        return None
+    finally:
+        connection.close()
+    return response['output'], response['exit_code']
@@ -0,0 +1,145 @@
+import os
+import time
+
+_process_time = getattr(time, 'process_time', getattr(time, 'clock', time.time))
+
+STAGES = ['read', 'extract', 'merge', 'clean', 'setup', 'check', 'report', 'file']
+
+
+def _stage_order(stage):
+    return (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)
+
+
+def _total_wall(timings):
+    return sum(wall for wall, _ in timings.values())
+
+
+def add_timings(timings, other):
+    for stage, (wall, cpu) in other.items():
+        totals = timings.setdefault(stage, [0.0, 0.0])
+        totals[0] += wall
+        totals[1] += cpu
+
+
+class _Measurement(object):
+    __slots__ = ('profiler', 'stage', 'timings', 'name', 'args', 'start')
+
+    def __init__(self, profiler, stage, timings, name, args):
+        self.profiler = profiler
+        self.stage = stage
+        self.timings = timings
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.profiler._children.append([0.0, 0.0])
+        self.start = (time.time(), _process_time())
+
+    def __exit__(self, *exc_info):
+        wall, cpu = time.time() - self.start[0], _process_time() - self.start[1]
+        children = self.profiler._children.pop()
+        if self.profiler._children:
+            parent = self.profiler._children[-1]
+            parent[0] += wall
+            parent[1] += cpu
+
+        elapsed = {self.stage: (wall - children[0], cpu - children[1])}
+        add_timings(self.profiler.stages, elapsed)
+        if self.timings is not None:
+            add_timings(self.timings, elapsed)
+        if self.profiler.events is not None:
+            pid = os.getpid()
+            self.profiler.events.append({
+                'name': self.name or self.stage, 'cat': self.stage, 'ph': 'X', 'pid': pid, 'tid': pid,
+                'ts': int(self.start[0] * 1e6), 'dur': int(wall * 1e6), 'args': self.args or {},
+            })
+
+
+class Profiler(object):
+    """Wall and CPU time of the stages of a run, in total and per block.
+
+    Nested measurements only count towards the innermost stage, so the setup of a checker doesn't include the
+    cleaning it triggers. Block timings are plain dicts shared with the block and its checker, stages measured
+    later, like the report, are added to them.
+
+    With ``trace`` every measurement is kept as an event in the Chrome trace-event format as well, tagged with the
+    process it ran in. ``name`` and ``args`` of a measurement only show in the trace.
+    """
+
+    def __init__(self, trace=False):
+        self.stages = {}
+        self.blocks = []
+        self.events = [] if trace else None
+        self._children = []
+
+    def measure(self, stage, timings=None, name=None, args=None):
+        return _Measurement(self, stage, timings, name, args)
+
+    def add_block(self, filename, source_block):
+        """Return the timings of a block, which include its cleaning and the cleaning of its parts."""
+        self.blocks.append((filename, source_block.start_line_number, source_block.directive, source_block.timings))
+        return source_block.timings
+
+    def merge(self, other):
+        add_timings(self.stages, other.stages)
+        self.blocks.extend(other.blocks)
+        if self.events is not None and other.events is not None:
+            self.events.extend(other.events)
+
+    def trace(self):
+        """Return the events as a JSON-serializable trace, which names the main and the worker processes."""
+        main_pid = os.getpid()
+        names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid,
+                  'args': {'name': 'flake8-rst' if pid == main_pid else 'worker {}'.format(pid)}}
+                 for pid in sorted({event['pid'] for event in self.events} | {main_pid})]
+        return {'traceEvents': names + self.events, 'displayTimeUnit': 'ms'}
+
+    def summary(self, count):
+        """Return the lines of the report: the totals per stage and the ``count`` slowest blocks."""
+        lines = ['{:<10} {:>10} {:>10}'.format('stage', 'wall', 'cpu')]
+        for stage in sorted(self.stages, key=_stage_order):
+            wall, cpu = self.stages[stage]
+            lines.append('{:<10} {:>9.3f}s {:>9.3f}s'.format(stage, wall, cpu))
+
+        blocks = sorted(self.blocks, key=lambda block: _total_wall(block[3]), reverse=True)[:count]
+        if blocks:
+            lines.append('slowest blocks:')
+        for filename, line_number, directive, timings in blocks:
+            stages = ', '.join('{} {:.3f}s'.format(stage, timings[stage][0])
+                               for stage in sorted(timings, key=_stage_order))
+            lines.append('{:>9.3f}s  {}:{} {} ({})'.format(_total_wall(timings), filename, line_number,
+                                                           directive or 'doctest', stages))
+        return lines
+
+
+class _NullMeasurement(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullProfiler(object):
+    """Stands in for :class:`Profiler` when nothing is measured."""
+    _measurement = _NullMeasurement()
+
+    def measure(self, stage, timings=None, name=None, args=None):
+        return self._measurement
+
+    def add_block(self, filename, source_block):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def make_profiler(options):
+    """Return a :class:`Profiler` if the run is profiled or traced, ``None`` otherwise."""
+    if options.profile_blocks or options.trace_file:
+        return Profiler(trace=bool(options.trace_file))
+    return None
+
+
+#: The profiler of the file being checked in this process, read by the stages which don't get it passed.
+current = NULL_PROFILER
@@ -1,8 +1,10 @@
 import re
+import tokenize
 from fnmatch import fnmatch
-from functools import wraps
+from functools import partial, wraps
 
-from .sourceblock import SourceBlock
+from . import profiling
+from .sourceblock import BlockGroup, SourceBlock
 
 COMMENT_RE = re.compile(r'(#.*$)', re.MULTILINE)
 
@@ -16,6 +18,13 @@ RST_RE = re.compile(
     re.MULTILINE,
 )
 
+DIRECTIVE_RE = re.compile(
+    r'^(?P<indent> *)\.\. (?P<directive>code-block|sourcecode|ipython)::( (?P<language>i?python|pycon))?$',
+    re.MULTILINE,
+)
+
+ROLE_LINE_RE = re.compile(r':\S+:')
+
 DOCSTRING_RE = re.compile(
     r'(?P<before>\n?)'
     r'^(?P<code>((?P<indent> *)r*\"{3}.*\n(?:(?:(?P=indent).+)?\n)*(?P=indent)\"{3}))',
@@ -23,22 +32,219 @@ DOCSTRING_RE = re.compile(
 )
 
 
+class LineMatch(object):
+    """Match of :class:`DirectiveScanner`, providing the groups of a :data:`RST_RE` match."""
+
+    def __init__(self, start, groups):
+        self._start = start
+        self._groups = groups
+
+    def start(self):
+        return self._start
+
+    def group(self, name):
+        try:
+            return self._groups[name]
+        except KeyError:
+            raise IndexError('no such group')
+
+
+class DirectiveScanner(object):
+    """Line based replacement of :data:`RST_RE`.
+
+    Directive lines are located by a pattern without backreferences, then their roles and indented body are
+    collected by walking the following lines. ``finditer`` yields the same matches as ``RST_RE.finditer``.
+    """
+
+    def finditer(self, src):
+        lines = src.split('\n')
+        index = position = 0
+        for directive in DIRECTIVE_RE.finditer(src):
+            start = directive.start()
+            if start < position or directive.end() == len(src):
+                continue
+
+            index += src.count('\n', position, start)
+            position = start
+            block = self._match_block(lines, index, len(directive.group('indent')))
+            if block is None:
+                continue
+
+            roles_end, code_start, code_end = block
+            roles = lines[index + 1:roles_end]
+            before = '\n'.join(lines[index:code_start]) + '\n'
+            code = '\n'.join(lines[code_start:code_end + 1])
+            if code_end < len(lines) - 1:
+                code += '\n'
+            yield LineMatch(start, {
+                'before': before,
+                'indent': directive.group('indent'),
+                'directive': directive.group('directive'),
+                'language': directive.group('language'),
+                'roles': '\n'.join(roles) + '\n' if roles else '',
+                'code': code,
+            })
+            index = code_start + code.count('\n')
+            position = start + len(before) + len(code)
+
+    @staticmethod
+    def _is_role_line(line, indent):
+        stripped = line.lstrip(' ')
+        return len(line) - len(stripped) > indent and ROLE_LINE_RE.match(stripped)
+
+    @staticmethod
+    def _last_code_line(lines, start, prefix):
+        """Return the last non blank line of the indented body starting at ``start``."""
+        last = len(lines) - 1
+        code_end = None
+        for index in range(start, last + 1):
+            line = lines[index]
+            if line.startswith(prefix):
+                code_end = index
+            elif line or index == last:
+                break
+        return code_end
+
+    def _match_block(self, lines, index, indent):
+        last = len(lines) - 1
+        prefix = ' ' * (indent + 3)
+
+        roles_end = index + 1
+        while roles_end < last and self._is_role_line(lines[roles_end], indent):
+            roles_end += 1
+
+        # Like the regex engine, hand trailing blank lines and roles over to the body until it is long enough.
+        for end in range(roles_end, index, -1):
+            code_start = end
+            if end == roles_end:
+                while code_start < last and not lines[code_start]:
+                    code_start += 1
+
+            code_end = self._last_code_line(lines, code_start, prefix)
+            if code_end is None:
+                continue
+            if code_end > code_start:
+                return end, code_start, code_end
+            if code_start > end:
+                return end, code_start - 1, code_end
+        return None
+
+
+RST_SCANNER = DirectiveScanner()
+
+
+class DocstringScanner(object):
+    """Find module, class and function docstrings of python source with :mod:`tokenize`.
+
+    Every docstring is matched with its complete lines, like :data:`DOCSTRING_RE` does, but without restrictions on
+    quotes, prefixes or the position of the closing quotes. Source which can't be tokenized falls back to
+    :data:`DOCSTRING_RE`.
+    """
+
+    IGNORED_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.INDENT}
+
+    def finditer(self, src):
+        try:
+            docstrings = list(self._docstrings(src))
+        except (tokenize.TokenError, SyntaxError):
+            for match in DOCSTRING_RE.finditer(src):
+                yield match
+            return
+
+        lines = src.split('\n')
+        line_offsets = [0]
+        for line in lines:
+            line_offsets.append(line_offsets[-1] + len(line) + 1)
+
+        for first, last in docstrings:
+            code = '\n'.join(lines[first:last + 1])
+            if last < len(lines) - 1:
+                code += '\n'
+            yield LineMatch(line_offsets[first], {'before': '', 'code': code})
+
+    def _docstrings(self, src):
+        """Yield first and last line index of every docstring."""
+        expecting = True
+        header = False
+        logical_start = True
+        depth = 0
+        candidate = None
+
+        # Lines are split at '\n' only, like the line indices of ``finditer``; unlike io.StringIO this takes str on py2.
+        lines = [line + '\n' for line in src.split('\n')]
+        lines[-1] = lines[-1][:-1]
+        readline = partial(next, iter(lines), '')
+
+        for token_type, text, start, end, _ in tokenize.generate_tokens(readline):
+            if token_type in self.IGNORED_TOKENS:
+                continue
+
+            if candidate is not None and token_type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                yield candidate
+            candidate = None
+
+            if token_type == tokenize.NEWLINE:
+                header = False
+                logical_start = True
+                continue
+            if token_type == tokenize.DEDENT:
+                expecting = False
+                continue
+
+            if expecting and token_type == tokenize.STRING:
+                prefix = text[:text.index(text[-1])].lower()
+                if 'b' not in prefix and 'f' not in prefix:
+                    candidate = (start[0] - 1, end[0] - 1)
+            expecting = False
+
+            if logical_start and token_type == tokenize.NAME and text in ('def', 'class', 'async'):
+                header = True
+            logical_start = False
+
+            if token_type == tokenize.OP:
+                if text in '([{':
+                    depth += 1
+                elif text in ')]}':
+                    depth -= 1
+                elif header and text == ':' and depth == 0:
+                    expecting = True
+
+
+DOCSTRING_SCANNER = DocstringScanner()
+
+
 def merge_by_group(func):
 
     @wraps(func)
     def func_wrapper(*args, **kwargs):
-        blocks = {}
+        groups = {}
         for block in func(*args, **kwargs):
             group = block.roles['group']
             if group == 'None':
                 yield block
             elif group == 'Ignore':
                 continue
+            elif group in groups:
+                groups[group].add(block)
             else:
-                data = blocks.setdefault(group, [])
-                data.append(block)
-        for merge_blocks in blocks.values():
-            yield SourceBlock.merge(merge_blocks)
+                groups[group] = BlockGroup(block)
+        for group in groups.values():
+            with profiling.current.measure('merge'):
+                block = group.merged()
+            yield block
+
+    return func_wrapper
+
+
+def select_changed_blocks(func):
+    """Keep only blocks with a line in ``changed_lines``; merged groups are kept whole if any of their blocks is."""
+
+    @wraps(func)
+    def func_wrapper(*args, **kwargs):
+        changed_lines = kwargs.pop('changed_lines', None)
+        for block in func(*args, **kwargs):
+            if changed_lines is None or block.intersects(changed_lines):
+                yield block
 
     return func_wrapper
 
@@ -80,21 +286,27 @@ def apply_default_groupnames(func):
 
 
 @apply_directive_specific_options
+@select_changed_blocks
 @merge_by_group
 @apply_default_groupnames
 def find_sourcecode(filename, options, src):
+    # Without examples or directives there is nothing to check, which spares tokenizing most python modules.
+    if '>>>' not in src and not DIRECTIVE_RE.search(src):
+        return
+
     contains_python_code = filename.split('.')[-1].startswith('py')
     source = SourceBlock.from_source(options.bootstrap, src)
-    source_blocks = source.find_blocks(DOCSTRING_RE) if contains_python_code else [source]
+    source_blocks = source.find_blocks(DOCSTRING_SCANNER) if contains_python_code else [source]
+
+    expression = RST_SCANNER if options.directive_scanner == 'line' else RST_RE
 
     for source_block in source_blocks:
-        inner_blocks = source_block.find_blocks(RST_RE)
+        inner_blocks = source_block.find_blocks(expression)
         found_inner_block = False
         for inner_block in inner_blocks:
             found_inner_block = True
-            inner_block.clean()
             yield inner_block
 
+        # Blocks are cleaned once they are checked, a docstring only needs its examples to count as a block.
         if not found_inner_block and source_block.clean_doctest():
-            source_block.clean()
             yield source_block
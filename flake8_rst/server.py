@@ -0,0 +1,117 @@
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from flake8 import exceptions, utils
+
+from .client import _receive
+
+try:
+    from StringIO import StringIO  # Python 2, where flake8 writes byte strings to stdout
+except ImportError:
+    from io import StringIO
+
+LOG = logging.getLogger(__name__)
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+class Server(object):
+    """Answer check requests of :mod:`flake8_rst.client` on a Unix socket.
+
+    Plugins and options are loaded once by the initialized ``application``; the IPython import, the transformation
+    memo and the option interner stay warm between requests. Requests are handled one after the other.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.socket_path = application.options.socket
+
+    def _is_listening(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.socket_path)
+        except (IOError, OSError):
+            return False
+        finally:
+            connection.close()
+        return True
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            if self._is_listening():
+                raise exceptions.ExecutionError('A server is already listening on {}'.format(self.socket_path))
+            os.remove(self.socket_path)
+
+        try:
+            # Leave through the ``finally`` below, which removes the socket.
+            signal.signal(signal.SIGTERM, _terminate)
+        except ValueError:
+            pass  # Only the main thread may install signal handlers.
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.socket_path)
+            listener.listen(5)
+            LOG.info('Listening on %s', self.socket_path)
+            while True:
+                connection, _ = listener.accept()
+                try:
+                    self.handle(connection)
+                finally:
+                    connection.close()
+        finally:
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle(self, connection):
+        data = _receive(connection)
+        if not data:
+            return  # A probe, like the one of a second server checking whether this one is alive.
+
+        try:
+            message = json.loads(data.decode('utf-8'))
+            output, exit_code = self.check(message['paths'], message['cwd'], message.get('stdin'))
+        except Exception:
+            LOG.exception('Request failed')
+            output, exit_code = traceback.format_exc(), 1
+        connection.sendall(json.dumps({'output': output, 'exit_code': exit_code}).encode('utf-8'))
+
+    def check(self, paths, cwd, stdin=None):
+        """Check ``paths`` as seen from ``cwd``, return what a run would print and its exit code."""
+        application = self.application
+        previous_cwd, stdout, stdin_stream = os.getcwd(), sys.stdout, sys.stdin
+        output = StringIO()
+        try:
+            os.chdir(cwd)
+            sys.stdout = output
+            if stdin is not None:
+                sys.stdin = io.TextIOWrapper(io.BytesIO(stdin.encode('utf-8')), encoding='utf-8')
+                # flake8 keeps the first stdin it has read.
+                getattr(utils.stdin_get_value, 'cache_clear', lambda: None)()
+
+            application.args = paths
+            application.start_time, application.end_time = time.time(), None
+            application.result_count = application.total_result_count = 0
+            application.catastrophic_failure = False
+            application.make_formatter()
+            application.make_guide()
+            application.file_checker_manager = None
+            application.make_file_checker_manager()
+            application.run_checks()
+            application.report()
+        finally:
+            os.chdir(previous_cwd)
+            sys.stdout, sys.stdin = stdout, stdin_stream
+
+        failed = application.result_count > 0 and not application.options.exit_zero
+        return output.getvalue(), int(failed or application.catastrophic_failure)
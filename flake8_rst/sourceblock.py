@@ -1,28 +1,120 @@
+import bisect
+import collections
+import hashlib
 import itertools
 import sys
+from array import array
 
 import doctest
 import operator
 import re
 
-try:
-    if sys.version_info > (3, 5):
-        import IPython.core.inputtransformer2 as ipt
-
-        transform_manager = ipt.TransformerManager()
-        transform_manager.cleanup_transforms.clear()
-        transform_cell = transform_manager.transform_cell
-        RUN_MAGIC_RE = re.compile(r"get_ipython\(\)\.run_line_magic\('(?:time(?:it)?)', (?P<x>(['\"]))(.*)(?P=x)\)",
-                                  re.MULTILINE)
-    else:
-        from IPython.core import inputsplitter as ipt
-
-        transformer = ipt.IPythonInputSplitter()
-        transform_cell = transformer.transform_cell
-        RUN_MAGIC_RE = re.compile(r"get_ipython\(\)\.magic\(u(?P<x>(['\"]))(?:time(?:it)?) (.*)(?P=x)\)",
-                                  re.MULTILINE)
-except ImportError:
-    ipt = transform_cell = None
+from . import profiling
+
+
+def _load_ipython():
+    """Import IPython and return its cell transformation and the pattern of run magics.
+
+    Importing IPython takes a large part of the startup time, so it is only loaded by the first block which needs it.
+    """
+    try:
+        if sys.version_info > (3, 5):
+            import IPython.core.inputtransformer2 as ipt
+
+            transform_manager = ipt.TransformerManager()
+            transform_manager.cleanup_transforms.clear()
+            transform_cell = transform_manager.transform_cell
+            run_magic_re = re.compile(r"get_ipython\(\)\.run_line_magic\('(?:time(?:it)?)', (?P<x>(['\"]))(.*)(?P=x)\)",
+                                      re.MULTILINE)
+        else:
+            from IPython.core import inputsplitter as ipt
+
+            transformer = ipt.IPythonInputSplitter()
+            transform_cell = transformer.transform_cell
+            run_magic_re = re.compile(r"get_ipython\(\)\.magic\(u(?P<x>(['\"]))(?:time(?:it)?) (.*)(?P=x)\)",
+                                      re.MULTILINE)
+    except ImportError:
+        return None, None
+    return transform_cell, run_magic_re
+
+
+_ipython_transform = None
+
+
+def get_ipython_transform():
+    global _ipython_transform
+    if _ipython_transform is None:
+        _ipython_transform = _load_ipython()
+    return _ipython_transform
+
+
+def _ipython_version():
+    """Return the version of the installed IPython from the package metadata, which spares importing IPython."""
+    try:
+        from importlib import metadata
+    except ImportError:  # Python < 3.8
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            metadata = None
+
+    if metadata is not None:
+        try:
+            return metadata.version('ipython')
+        except metadata.PackageNotFoundError:
+            return None
+
+    try:
+        import pkg_resources
+    except ImportError:
+        return None
+    try:
+        return pkg_resources.get_distribution('ipython').version
+    except pkg_resources.DistributionNotFound:
+        return None
+
+
+def _to_bytes(text):
+    # Python 2 hands lines and file names around as byte strings already, encoding them would decode them as ASCII.
+    return text if isinstance(text, bytes) else text.encode('utf-8', 'backslashreplace')
+
+
+class TransformMemo(object):
+    """Bounded LRU memo of cells transformed by IPython, shared by all blocks of a process.
+
+    With a ``store``, e.g. the :class:`~flake8_rst.cache.ResultCache`, transformations are also persisted between runs.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.store = None
+        self._cells = collections.OrderedDict()
+        self._version = None
+
+    def _key(self, cell):
+        if self._version is None:
+            self._version = repr(_ipython_version())
+        digest = hashlib.sha1(self._version.encode('utf-8'))
+        digest.update(_to_bytes(cell))
+        return 'ipython-' + digest.hexdigest()
+
+    def get(self, cell):
+        transformed = self._cells.pop(cell, None)
+        if transformed is None and self.store is not None:
+            transformed = self.store.get(self._key(cell))
+        if transformed is not None:
+            self._cells[cell] = transformed
+        return transformed
+
+    def set(self, cell, transformed):
+        self._cells[cell] = transformed
+        while len(self._cells) > self.max_size:
+            self._cells.popitem(last=False)
+        if self.store is not None:
+            self.store.set(self._key(cell), transformed)
+
+
+transform_memo = TransformMemo()
 
 LINENO, SOURCE, RAW = range(3)
 
@@ -30,7 +122,12 @@ ROLE_RE = re.compile(r':flake8-(?P<role>\S*):\s?(?P<value>.*)$', re.MULTILINE)
 
 INDENT_RE = re.compile(r'(?P<indent>^ *).', re.MULTILINE)
 
-DEFAULT_IGNORED_LINES = [re.compile(r'get_ipython\(\)|^@(savefig\s.*|ok(except|warning)|verbatim|doctest)$')]
+DEFAULT_IGNORED_LINES = [r'get_ipython\(\)', r'@(savefig\s.*|ok(except|warning)|verbatim|doctest)$']
+
+# Escaped commands, magic and system assignments and help requests; without them IPython leaves a cell unchanged.
+CONSOLE_SYNTAX_RE = re.compile(r'^\s*[%!?,;/]|=\s*[%!]|\?', re.MULTILINE)
+
+DOCTEST_PARSER = doctest.DocTestParser()
 
 IPYTHON_START_RE = re.compile(r'In \[(?P<lineno>\d+)\]:\s?(?P<code>.*\n)')
 IPYTHON_FOLLOW_RE = re.compile(r'^\.{3}:\s?(?P<code>.*\n)')
@@ -38,6 +135,22 @@ IPYTHON_FOLLOW_RE = re.compile(r'^\.{3}:\s?(?P<code>.*\n)')
 ROLES = ['group', 'bootstrap']
 
 
+_ignored_lines_res = {}
+
+
+def ignored_lines_re(patterns=''):
+    """Combine the default ignored lines and ``patterns``, one per line, into a single compiled pattern.
+
+    Like the defaults, every pattern is matched at the start of a line.
+    """
+    ignored_re = _ignored_lines_res.get(patterns)
+    if ignored_re is None:
+        extra = [pattern.strip() for pattern in patterns.splitlines() if pattern.strip()]
+        ignored_re = re.compile('|'.join('(?:{})'.format(pattern) for pattern in DEFAULT_IGNORED_LINES + extra))
+        _ignored_lines_res[patterns] = ignored_re
+    return ignored_re
+
+
 def _match_default(match, group, default=None):
     try:
         return match.group(group)
@@ -45,6 +158,15 @@ def _match_default(match, group, default=None):
         return default
 
 
+def _newline_offsets(src):
+    offsets = []
+    index = src.find('\n')
+    while index != -1:
+        offsets.append(index)
+        index = src.find('\n', index + 1)
+    return offsets
+
+
 def _extract_roles(role_block):
     roles = {}
     if not role_block:
@@ -54,45 +176,120 @@ def _extract_roles(role_block):
     return roles
 
 
+class SourceLines(object):
+    """Sequence of ``(lineno, source, raw)`` lines, stored column by column.
+
+    Line numbers are kept in an ``array`` and the strings in two lists, which share the strings of the original source
+    wherever a line wasn't changed. This avoids a tuple per line, and slicing or concatenating copies the columns at
+    once instead of line by line. Indexing still returns ``(lineno, source, raw)`` tuples.
+    """
+
+    __slots__ = ('linenos', 'sources', 'raws')
+
+    def __init__(self, lines=()):
+        self.linenos = array('i')
+        self.sources = []
+        self.raws = []
+        for lineno, source, raw in lines:
+            self.linenos.append(lineno)
+            self.sources.append(source)
+            self.raws.append(raw)
+
+    @classmethod
+    def from_columns(cls, linenos, sources, raws):
+        """Create lines from the given columns, which are taken over without copying."""
+        lines = cls()
+        lines.linenos = linenos
+        lines.sources = sources
+        lines.raws = raws
+        return lines
+
+    @classmethod
+    def concat(cls, parts):
+        lines = cls()
+        for part in parts:
+            lines.linenos.extend(part.linenos)
+            lines.sources.extend(part.sources)
+            lines.raws.extend(part.raws)
+        return lines
+
+    def __len__(self):
+        return len(self.linenos)
+
+    def __iter__(self):
+        return iter(zip(self.linenos, self.sources, self.raws))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.from_columns(self.linenos[index], self.sources[index], self.raws[index])
+        return self.linenos[index], self.sources[index], self.raws[index]
+
+    def __add__(self, other):
+        return self.concat([self, other])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getstate__(self):
+        return self.linenos, self.sources, self.raws
+
+    def __setstate__(self, state):
+        self.linenos, self.sources, self.raws = state
+
+
 class SourceBlock(object):
     @classmethod
     def from_source(cls, bootstrap, src, start_line=1, **kwargs):
         if bootstrap:
             boot_lines = SourceBlock.convert_bootstrap(bootstrap)
         else:
-            boot_lines = []
-        code_lines = [(i, line, line) for i, line in enumerate(src.splitlines(True), start=start_line)]
+            boot_lines = SourceLines()
+        sources = src.splitlines(True)
+        code_lines = SourceLines.from_columns(array('i', range(start_line, start_line + len(sources))),
+                                              sources, list(sources))
         return cls(boot_lines, code_lines, **kwargs)
 
     @staticmethod
     def convert_bootstrap(bootstrap, split='\n'):
-        return [(0, line + '\n', line + '\n') for line in bootstrap.split(split)]
+        sources = [line + '\n' for line in bootstrap.split(split)]
+        return SourceLines.from_columns(array('i', [0] * len(sources)), sources, list(sources))
 
     @classmethod
     def merge(cls, source_blocks):
         """Merge multiple SourceBlocks together"""
 
-        if len(source_blocks) == 1:
-            return source_blocks[0]
-
-        source_blocks.sort(key=operator.attrgetter('start_line_number'))
-        main_block = source_blocks[0]
-        boot_lines = main_block.boot_lines
-        source_lines = [source_line for source_block in source_blocks for source_line in source_block.source_lines]
-
-        return cls(boot_lines, source_lines, directive=main_block.directive,
-                   language=main_block.language, roles=main_block.roles)
+        group = BlockGroup(source_blocks[0])
+        for source_block in source_blocks[1:]:
+            group.add(source_block)
+        return group.merged()
 
     def __init__(self, boot_lines, source_lines, directive='', language='', roles=None):
-        self._boot_lines = boot_lines
-        self._source_lines = source_lines
+        self._boot_lines = boot_lines if isinstance(boot_lines, SourceLines) else SourceLines(boot_lines)
         self.directive = directive
         self.language = language
         self.roles = roles or {}
+        self.ipython_transforms = 0
+        self.timings = {}
+        self._parts = None
+        self._cleaned = False
 
         if 'bootstrap' in self.roles:
             self._boot_lines = SourceBlock.convert_bootstrap(self.roles['bootstrap'], split='; ')
 
+        self._set_source_lines(source_lines)
+        self.raw_linenos = self._source_lines.linenos
+
+    def _set_source_lines(self, source_lines):
+        if not isinstance(source_lines, SourceLines):
+            source_lines = SourceLines(source_lines)
+        self._source_lines = source_lines
+        self._all_lines = None
+        self._source_block = None
+        self._complete_block = None
+
     @property
     def boot_lines(self):
         return self._boot_lines
@@ -101,31 +298,48 @@ class SourceBlock(object):
     def source_lines(self):
         return self._source_lines
 
+    @property
+    def all_lines(self):
+        if self._all_lines is None:
+            self._all_lines = self._boot_lines + self._source_lines
+        return self._all_lines
+
     @property
     def source_block(self):
         """Return code lines **without** bootstrap"""
-        return "".join(line[SOURCE] for line in self._source_lines)
+        if self._source_block is None:
+            self._source_block = "".join(self._source_lines.sources)
+        return self._source_block
 
     @property
     def complete_block(self):
         """Return code lines **with** bootstrap"""
-        return "".join(line[SOURCE] for line in self._boot_lines + self._source_lines)
+        if self._complete_block is None:
+            self._complete_block = "".join(self.all_lines.sources)
+        return self._complete_block
 
     @property
     def start_line_number(self):
-        return self._source_lines[0][LINENO]
+        return self._source_lines.linenos[0]
+
+    def intersects(self, line_numbers):
+        """Return ``True`` if one of the ``line_numbers`` of the document is a line of this block.
+
+        Lines dropped by cleaning, like the output of examples, count as well, whether the block is cleaned or not.
+        """
+        return not line_numbers.isdisjoint(self.raw_linenos)
 
     def get_code_line(self, lineno):
-        all_lines = self._boot_lines + self._source_lines
-        line = all_lines[lineno - 1]
+        line = self.all_lines[lineno - 1]
         return {'lineno': line[LINENO], 'indent': len(line[RAW]) - len(line[SOURCE]),
                 'source': line[SOURCE], 'raw_source': line[RAW]}
 
     def find_blocks(self, expression):
         src = self.source_block
+        newline_offsets = _newline_offsets(src)
         for match in expression.finditer(src):
             origin_code = str(match.group('code'))
-            line_start = src[:match.start()].count('\n') + match.group('before').count('\n')
+            line_start = bisect.bisect_left(newline_offsets, match.start()) + match.group('before').count('\n')
             source_slice = slice(line_start, line_start + len(origin_code.splitlines(True)))
             directive = _match_default(match, 'directive', '')
             language = _match_default(match, 'language', '')
@@ -137,32 +351,57 @@ class SourceBlock(object):
             yield source_block
 
     def remove_indentation(self):
-        indentation = min(INDENT_RE.findall(self.source_block))
+        # Not cached on the block, which keeps a block waiting for its group free of any text.
+        indentation = min(INDENT_RE.findall(''.join(self._source_lines.sources)))
         if indentation:
             indent = len(indentation)
-            source_lines = [(line[LINENO], line[SOURCE][indent:-1] + line[SOURCE][-1], line[RAW])
-                            for line in self._source_lines]
-            self._source_lines = source_lines
-
-    def clean(self):
-        for func in (self.clean_doctest, self.clean_ipython):
-            if func():
-                break
-
-        self.clean_console_syntax()
-        self.clean_ignored_lines()
+            sources = [source[indent:-1] + source[-1] for source in self._source_lines.sources]
+            self._set_source_lines(SourceLines.from_columns(self._source_lines.linenos, sources,
+                                                            self._source_lines.raws))
+
+    def clean(self, ignored_re=None):
+        """Clean the block for checking, once; a merged block cleans each of its parts on its own."""
+        if self._cleaned:
+            return
+        self._cleaned = True
+
+        if self._parts is not None:
+            for part in self._parts:
+                part.clean(ignored_re)
+                self.ipython_transforms += part.ipython_transforms
+                profiling.add_timings(self.timings, part.timings)
+            self._set_source_lines(SourceLines.concat(part.source_lines for part in self._parts))
+            self._parts = None
+            return
+
+        with profiling.current.measure('clean', self.timings):
+            for func in (self.clean_doctest, self.clean_ipython):
+                if func():
+                    break
+
+            self.clean_console_syntax()
+            self.clean_ignored_lines(ignored_re)
 
     def clean_doctest(self):
+        block = self.source_block
+        if '>>>' not in block:
+            return False
+
         try:
-            lines = doctest.DocTestParser().get_examples(self.source_block)
+            examples = DOCTEST_PARSER.get_examples(block)
         except ValueError:
             return None
 
-        source_lines = [source_line for line in lines
-                        for source_line in self._overwritten_source(line.source, line.lineno)]
+        # The lines of an example are the lines following its lineno, without prompts and indentation.
+        linenos, sources, raws = array('i'), [], []
+        for example in examples:
+            example_lines = self._source_lines[example.lineno:example.lineno + example.source.count('\n')]
+            linenos.extend(example_lines.linenos)
+            sources.extend(example.source.splitlines(True)[:len(example_lines)])
+            raws.extend(example_lines.raws)
 
-        if source_lines:
-            self._source_lines = source_lines
+        if linenos:
+            self._set_source_lines(SourceLines.from_columns(linenos, sources, raws))
             return True
         return False
 
@@ -192,19 +431,26 @@ class SourceBlock(object):
         source_lines.extend(self._overwritten_source(src, lineno))
 
         if source_lines:
-            self._source_lines = source_lines
+            self._set_source_lines(source_lines)
             return True
         return False
 
     def clean_console_syntax(self):
-        if not transform_cell:
-            return False
         block = self.source_block
-        source_block = transform_cell(block)
-        source_block = re.sub(RUN_MAGIC_RE, r'\3', source_block)
+        if not CONSOLE_SYNTAX_RE.search(block):
+            return False
+        source_block = transform_memo.get(block)
+        if source_block is None:
+            transform_cell, run_magic_re = get_ipython_transform()
+            if not transform_cell:
+                return False
+            self.ipython_transforms += 1
+            source_block = transform_cell(block)
+            source_block = re.sub(run_magic_re, r'\3', source_block)
+            transform_memo.set(block, source_block)
 
         if block != source_block:
-            self._source_lines = list(self._overwritten_source(source_block))
+            self._set_source_lines(list(self._overwritten_source(source_block)))
             return True
         return False
 
@@ -215,8 +461,43 @@ class SourceBlock(object):
 
             yield (lineno, line, raw)
 
-    def clean_ignored_lines(self):
-        for i, (_, source, _) in enumerate(self._source_lines):
-            for pattern in DEFAULT_IGNORED_LINES:
-                if pattern.match(source):
-                    self._source_lines.pop(i)
+    def clean_ignored_lines(self, ignored_re=None):
+        match = (ignored_re or ignored_lines_re()).match
+        lines = self._source_lines
+        kept = [index for index, source in enumerate(lines.sources) if not match(source)]
+        if len(kept) < len(lines):
+            self._set_source_lines(SourceLines.from_columns(array('i', (lines.linenos[index] for index in kept)),
+                                                            [lines.sources[index] for index in kept],
+                                                            [lines.raws[index] for index in kept]))
+
+
+class BlockGroup(object):
+    """Blocks of one group, collected as they are extracted.
+
+    The merged block starts out with the uncleaned lines of all blocks. It keeps the blocks themselves until it is
+    cleaned, as every block is cleaned on its own.
+    """
+    __slots__ = ('main_block', 'parts')
+
+    def __init__(self, source_block):
+        self.main_block = source_block
+        self.parts = []
+        self.add(source_block)
+
+    def add(self, source_block):
+        if source_block.start_line_number < self.main_block.start_line_number:
+            self.main_block = source_block
+        self.parts.append(source_block)
+
+    def merged(self):
+        if len(self.parts) == 1:
+            return self.main_block
+
+        self.parts.sort(key=operator.attrgetter('start_line_number'))
+        main_block = self.main_block
+        source_lines = SourceLines.concat(source_block.source_lines for source_block in self.parts)
+
+        merged_block = SourceBlock(main_block.boot_lines, source_lines, directive=main_block.directive,
+                                   language=main_block.language, roles=main_block.roles)
+        merged_block._parts = self.parts
+        return merged_block
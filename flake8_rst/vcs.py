@@ -0,0 +1,33 @@
+import subprocess
+
+from flake8 import exceptions, utils
+
+
+def _git(*args):
+    try:
+        output = subprocess.check_output(('git',) + args, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise exceptions.ExecutionError('Could not run git: {}'.format(e))
+    except subprocess.CalledProcessError as e:
+        stderr = (getattr(e, 'stderr', None) or b'').decode('utf-8', 'replace').strip()
+        raise exceptions.ExecutionError('git {} failed: {}'.format(args[0], stderr or e))
+    return output.decode('utf-8', 'replace')
+
+
+def changed_lines_since(ref, filename_patterns, paths=()):
+    """Map the files changed since ``ref`` to their changed lines, untracked files map to ``None``.
+
+    Paths are relative to the working directory and limited to ``paths`` and files matching ``filename_patterns``,
+    like ``--filename`` limits a complete run. The diff keeps a line of context, so removed lines select the lines
+    around them.
+    """
+    pathspec = ('--',) + tuple(paths)
+    diff = _git('diff', '-U1', '--relative', '--no-color', '--no-ext-diff', '--diff-filter=d',
+                '--src-prefix=a/', '--dst-prefix=b/', ref, *pathspec)
+    changed = {filename: lines for filename, lines in utils.parse_unified_diff(diff).items()
+               if utils.fnmatch(filename, filename_patterns)}
+
+    for filename in _git('ls-files', '--others', '--exclude-standard', *pathspec).splitlines():
+        if utils.fnmatch(filename, filename_patterns):
+            changed[filename] = None
+    return changed
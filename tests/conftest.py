@@ -22,6 +22,18 @@ def data_dir():
     return DATA_DIR
 
 
+@pytest.fixture()
+def application():
+    from flake8_rst.application import Application
+
+    def initialize(argv):
+        application = Application()
+        application.initialize(argv)
+        return application
+
+    return initialize
+
+
 def read_ast(self):
     with self.open() as f:
         return ast.literal_eval(f.read())
@@ -0,0 +1,197 @@
+import optparse
+import os
+import pickle
+
+import pytest
+
+from flake8_rst.cache import FileManifest, ResultCache, options_fingerprint
+from flake8_rst.checker import RstFileChecker
+from flake8_rst.sourceblock import SourceBlock
+
+
+@pytest.fixture()
+def options():
+    return optparse.Values(dict(max_line_length=80, verbose=0, hang_closing=False, max_doc_length=100,
+                                disable_noqa=False, jobs='auto', ignored_lines_regex=''))
+
+
+@pytest.fixture()
+def cache(tmpdir, options):
+    return ResultCache(str(tmpdir.join('cache')), options_fingerprint(options, [('pyflakes', '2.2.0')]))
+
+
+def make_checker(options, src, start_line=1):
+    source_block = SourceBlock.from_source('', src, start_line=start_line)
+    return RstFileChecker('dummy.rst', {}, options, source_block=source_block)
+
+
+def test_fingerprint_ignores_run_options(options):
+    fingerprint = options_fingerprint(options, [])
+    options.jobs = 4
+
+    assert fingerprint == options_fingerprint(options, [])
+
+    options.max_line_length = 120
+
+    assert fingerprint != options_fingerprint(options, [])
+
+
+def test_fingerprint_ignores_order(options):
+    options.ignore = ['E121', 'W503']
+    fingerprint = options_fingerprint(options, [])
+    options.ignore = ['W503', 'E121']
+
+    assert fingerprint == options_fingerprint(options, [])
+
+
+def test_load_saved_results(cache, options):
+    checker = make_checker(options, 'import os\nx = 1\n')
+    checker.results = [('F401', 1, 0, "'os' imported but unused", 'import os\n')]
+    checker.statistics = {'tokens': 8, 'logical lines': 2, 'physical lines': 2}
+    cache.save(checker, cache.key(checker.source_block))
+
+    moved = make_checker(options, 'import os\nx = 1\n', start_line=10)
+    cache.restore(moved, cache.get(cache.key(moved.source_block)))
+
+    assert moved.results == [('F401', 10, 0, "'os' imported but unused", 'import os\n')]
+    assert moved.statistics == checker.statistics
+
+
+def test_results_of_cleaned_block(cache, options):
+    src = '>>> import os\n>>> x = 1\n2\n'
+    block = SourceBlock.from_source('', src, start_line=5)
+    key = cache.key(block)
+    checker = RstFileChecker.from_sourcecode(filename='dummy.rst', checks={}, options=options, style_guide=None,
+                                             source_block=block)
+    checker.results = [('F401', 5, 0, "'os' imported but unused", 'import os\n')]
+    cache.save(checker, key)
+
+    uncleaned = SourceBlock.from_source('', src, start_line=5)
+    restored = RstFileChecker.from_sourcecode(filename='dummy.rst', checks={}, options=options, style_guide=None,
+                                              source_block=uncleaned, clean=False)
+    cache.restore(restored, cache.get(cache.key(uncleaned)))
+
+    assert uncleaned.source_block == src
+    assert restored.results == checker.results
+
+
+def test_miss_on_changed_block(cache, options):
+    checker = make_checker(options, 'x = 1\n')
+    cache.save(checker, cache.key(checker.source_block))
+
+    assert cache.get(cache.key(make_checker(options, 'x = 2\n').source_block)) is None
+
+
+def test_prune_least_recently_used(tmpdir, options):
+    cache = ResultCache(str(tmpdir.join('cache')), '', max_size=0)
+    checker = make_checker(options, 'x = 1\n')
+    key = cache.key(checker.source_block)
+    cache.save(checker, key)
+    cache.prune()
+
+    assert cache.get(key) is None
+
+
+class _Payload(object):
+    def __reduce__(self):
+        return (open, (self.path, 'w'))
+
+
+def test_pickled_entries_are_not_loaded(tmpdir, cache, options):
+    checker = make_checker(options, 'x = 1\n')
+    key = cache.key(checker.source_block)
+    cache.save(checker, key)
+    payload = _Payload()
+    payload.path = str(tmpdir.join('executed'))
+    with open(cache._path(key), 'wb') as f:
+        pickle.dump(payload, f)
+
+    assert cache.get(key) is None
+    assert not tmpdir.join('executed').check()
+
+
+def test_prune_keeps_foreign_files(tmpdir, options):
+    cache = ResultCache(str(tmpdir), '', max_size=0)
+    checker = make_checker(options, 'x = 1\n')
+    cache.save(checker, cache.key(checker.source_block))
+    notes = tmpdir.join('notes.txt')
+    notes.write('keep me')
+    foreign = tmpdir.join('entries', 'notes.txt')
+    foreign.write('keep me too')
+    cache.prune()
+
+    assert notes.check() and foreign.check()
+    assert tmpdir.join('entries', 'CACHEDIR.TAG').check()
+    assert sorted(path.basename for path in tmpdir.join('entries').listdir()) == ['CACHEDIR.TAG', 'notes.txt']
+
+
+def test_prune_only_after_writes(tmpdir, options, mocker):
+    cache = ResultCache(str(tmpdir), '', max_size=0)
+    checker = make_checker(options, 'x = 1\n')
+    cache.save(checker, cache.key(checker.source_block))
+    cache.prune()
+    listdir = mocker.spy(os, 'listdir')
+    cache.prune()
+
+    assert not listdir.called
+
+    cache.save(checker, cache.key(checker.source_block))
+    cache.prune()
+
+    assert listdir.called
+    assert tmpdir.join('entries').listdir() == [tmpdir.join('entries', 'CACHEDIR.TAG')]
+
+
+def test_prune_untagged_directory(tmpdir):
+    entry = tmpdir.join('entries', 'a' * 40)
+    entry.write('x', ensure=True)
+    ResultCache(str(tmpdir), '', max_size=0).prune()
+
+    assert entry.check()
+
+
+def test_unchanged_file_skips_extraction(tmpdir, mocker, application):
+    from flake8_rst.checker import _check_file
+
+    app = application(['--cache-dir={}'.format(tmpdir.join('cache'))])
+    manager = app.file_checker_manager
+    document = tmpdir.join('document.rst')
+    document.write('.. code-block:: python\n\n    import os\n')
+    args = (str(document), manager.checks.to_dictionary(), app.options, manager.cache, None)
+
+    checkers, _ = _check_file(args)
+    expected = [checker.results for checker in checkers]
+    find_sourcecode = mocker.patch('flake8_rst.checker.find_sourcecode')
+    checkers, _ = _check_file(args)
+
+    assert [checker.results for checker in checkers] == expected
+    assert not find_sourcecode.called
+
+    document.write('.. code-block:: python\n\n    import sys\n')
+    _check_file(args)
+
+    assert find_sourcecode.called
+
+
+def test_restored_blocks_selected_by_uncleaned_lines(tmpdir, application):
+    from flake8_rst.checker import _check_file
+
+    app = application(['--cache-dir={}'.format(tmpdir.join('cache'))])
+    manager = app.file_checker_manager
+    document = tmpdir.join('document.rst')
+    document.write('.. code-block:: pycon\n\n    >>> import os\n    >>> 1 + 1\n    2\n')
+    checks = manager.checks.to_dictionary()
+
+    def check(changed_lines, cache=manager.cache):
+        checkers, _ = _check_file((str(document), checks, app.options, cache, changed_lines))
+        return [result[:2] for checker in checkers for result in checker.results]
+
+    # The first run cleans the block and stores it in the manifest, the second restores it from there.
+    check(None)
+
+    assert check({5}) == check({5}, cache=None) == [('F401', 3)]
+
+
+def test_digest_of_byte_strings():
+    # Python 2 reads files as byte strings.
+    assert FileManifest._digest(u'caf\xe9\n'.encode('utf-8')) == FileManifest._digest(u'caf\xe9\n')
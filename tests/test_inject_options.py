@@ -1,9 +1,10 @@
 import optparse
+import pickle
 import pytest
 from hypothesis import given
 from hypothesis import strategies as st
 
-from flake8_rst.checker import inject_options, RstFileChecker
+from flake8_rst.checker import inject_options, roles_key, OptionsInterner, RstFileChecker
 
 
 @given(key=st.sampled_from(['ignore', 'select']))
@@ -30,15 +31,58 @@ def test_add_options(key, values, expected):
     assert ['F821', 'E305'] == options.__dict__[key]
 
 
-def test_selecting_decision_engine(mocker):
-    style_guide = mocker.Mock(decider=mocker.Mock())
-    decider = mocker.Mock()
-    options = mocker.Mock(max_line_length=80, verbose=0, hang_closing=False)
+def test_roles_decide_at_report_time(tmpdir, application):
+    document = tmpdir.join('document.rst')
+    document.write('.. code-block:: python\n'
+                   '    :flake8-add-ignore: F401\n\n'
+                   '    import os\n\n'
+                   '.. code-block:: python\n'
+                   '    :flake8-group: None\n\n'
+                   '    import sys\n')
+
+    app = application(['--no-cache', '--filename=*.rst', str(document)])
+    app.run_checks()
+    results_found, results_reported = app.file_checker_manager.report()
+
+    assert (results_found, results_reported) == (2, 1)
+
+
+def test_pickle_checker_without_style_guide():
+    options = optparse.Values(dict(max_line_length=80, verbose=0, hang_closing=False, max_doc_length=100,
+                                   disable_noqa=False))
 
     checker = RstFileChecker('dummy.py', {}, options)
-    checker.style_guide = style_guide
-    checker.decider = decider
+    checker.style_guide = object()
+    restored = pickle.loads(pickle.dumps(checker))
+
+    assert restored.style_guide is None
+    assert restored.filename == checker.filename
+
+
+def test_interned_options():
+    options = optparse.Values(dict(ignore=['E305'], select=['E', 'F'], extended_default_select=[],
+                                   enable_extensions=[], extend_ignore=[], disable_noqa=False))
+    interner = OptionsInterner(options)
+
+    key = roles_key({'add-ignore': 'F821, E302', 'group': 'A'})
+
+    assert key == roles_key({'add-ignore': 'E302,F821', 'group': 'B'})
+    assert interner.options(key) is interner.options(roles_key({'add-ignore': 'E302,F821'}))
+    assert sorted(interner.options(key).ignore) == ['E302', 'E305', 'F821']
+    assert interner.decider(key) is interner.decider(key)
+    assert interner.options(()) is options
+
+
+def test_noqa_lines_of_invalid_block(application):
+    from flake8_rst.sourceblock import SourceBlock
+
+    app = application(['--no-cache'])
+    checks = app.file_checker_manager.checks.to_dictionary()
+    source_block = SourceBlock.from_source('', 'x = 1  \ny = 2  \nz = (\n')
 
-    checker.results
+    checker = RstFileChecker('dummy.rst', checks, app.options, source_block=source_block)
+    checker.run_checks()
 
-    assert decider is style_guide.__dict__['decider']
+    assert checker._noqa_lines is False
+    assert {(line_number, source) for code, line_number, _, _, source in checker.results if code == 'W291'} == {
+        (1, 'x = 1  \n'), (2, 'y = 2  \n')}
@@ -9,7 +9,7 @@ from flake8_rst.sourceblock import SourceBlock
 def options(mocker):
     return mocker.Mock(max_line_length=80, verbose=0, hang_closing=False, max_doc_length=100,
                        ignore=[], bootstrap=None, default_groupnames='*.rst->*: default',
-                       disable_noqa=False)
+                       disable_noqa=False, ignored_lines_regex='')
 
 
 @pytest.fixture()
@@ -32,14 +32,8 @@ def checker(request, options, checks):
 
 
 @pytest.fixture()
-def summary(request, options, checks):
-    from flake8_rst.application import Application
-    with tempfile.NamedTemporaryFile() as file:
-        application = Application()
-        application.initialize(["--output-file={}".format(file.name), "--show-source"])
-        application.run_checks([str(request.param)])
-        application.report()
-        return file.read().decode('utf-8')
+def summary(request, options, checks, application):
+    return run_application(application, [str(request.param)])[0]
 
 
 @pytest.fixture()
@@ -84,3 +78,22 @@ def test_readline(source, checks, options):
     lines = checker.processor.read_lines()
 
     assert src == ''.join(lines)
+
+
+def run_application(application, paths, *argv):
+    with tempfile.NamedTemporaryFile() as file:
+        app = application(["--output-file={}".format(file.name), "--show-source", "--no-cache"] + list(argv))
+        app.run_checks(paths)
+        app.report()
+        return file.read().decode('utf-8'), app.file_checker_manager.jobs
+
+
+def test_parallel_run_matches_serial(data_dir, application):
+    paths = sorted(str(path) for path in data_dir.glob('*'))
+
+    serial, _ = run_application(application, paths, '--jobs=1')
+    parallel, jobs = run_application(application, paths, '--jobs=2')
+
+    assert jobs == 2
+    assert serial
+    assert parallel == serial
@@ -0,0 +1,51 @@
+from flake8_rst.profiling import Profiler
+from flake8_rst.sourceblock import SourceBlock
+
+
+def test_nested_stages_are_exclusive(mocker):
+    clock = iter([0.0, 1.0, 3.0, 4.0])
+    mocker.patch('flake8_rst.profiling.time.time', side_effect=lambda: next(clock))
+    mocker.patch('flake8_rst.profiling._process_time', return_value=0.0)
+    profiler = Profiler()
+    timings = {}
+
+    with profiler.measure('extract'):
+        with profiler.measure('clean', timings):
+            pass
+
+    assert profiler.stages == {'extract': [2.0, 0.0], 'clean': [2.0, 0.0]}
+    assert timings == {'clean': [2.0, 0.0]}
+
+
+def test_summary_lists_slowest_blocks():
+    profiler = Profiler()
+    for line_number, wall in [(1, 0.5), (10, 2.0), (20, 1.0)]:
+        source_block = SourceBlock.from_source('', 'x = 1\n', line_number, directive='code-block')
+        timings = profiler.add_block('doc.rst', source_block)
+        timings['check'] = [wall, wall]
+
+    lines = profiler.summary(2)
+
+    assert lines[-3] == 'slowest blocks:'
+    assert lines[-2].split()[:3] == ['2.000s', 'doc.rst:10', 'code-block']
+    assert lines[-1].split()[:2] == ['1.000s', 'doc.rst:20']
+
+
+def test_trace_file(tmpdir):
+    import json
+    from flake8_rst.application import Application
+
+    document = tmpdir.join('doc.rst')
+    document.write('.. code-block:: python\n\n    import os\n')
+    trace_file = tmpdir.join('trace.json')
+
+    application = Application()
+    application.run(['--no-cache', '--trace-file', str(trace_file), str(document)])
+
+    events = json.loads(trace_file.read())['traceEvents']
+    names = {event['name'] for event in events if event['ph'] == 'X'}
+    categories = {event['cat'] for event in events if event['ph'] == 'X'}
+
+    assert {'read', 'extract', 'setup', 'check', 'report', 'file'} <= categories
+    assert {'F', 'build ast', 'logical and physical lines'} <= names
+    assert [event['args']['name'] for event in events if event['ph'] == 'M'] == ['flake8-rst']
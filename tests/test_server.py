@@ -0,0 +1,112 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from flake8_rst import client
+from flake8_rst.server import Server
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['--client', 'doc.rst'], (client.DEFAULT_SOCKET, ['doc.rst'])),
+    (['--client', '--socket', 'x.sock', '-'], ('x.sock', ['-'])),
+    (['--client', '--socket=x.sock', 'a.rst', 'b.rst'], ('x.sock', ['a.rst', 'b.rst'])),
+    (['--client', '--select=E', 'doc.rst'], None),
+])
+def test_parse_arguments(tmpdir, monkeypatch, argv, expected):
+    monkeypatch.chdir(tmpdir)
+
+    assert client.parse_arguments(argv) == expected
+
+
+def test_find_socket_of_project(tmpdir, monkeypatch):
+    project = tmpdir.join('project')
+    project.join('.git').ensure(dir=True)
+    project.join(client.DEFAULT_SOCKET).ensure()
+    tmpdir.join(client.DEFAULT_SOCKET).ensure()
+    monkeypatch.chdir(project.join('docs', 'api').ensure(dir=True))
+
+    assert client.parse_arguments(['--client', 'index.rst']) == (str(project.join(client.DEFAULT_SOCKET)),
+                                                                 ['index.rst'])
+    assert client.find_socket(str(tmpdir.join('other').ensure(dir=True))) == str(tmpdir.join(client.DEFAULT_SOCKET))
+
+    other_project = tmpdir.join('other-project')
+    other_project.join('.git').ensure(dir=True)
+
+    assert client.find_socket(str(other_project.join('docs').ensure(dir=True))) is None
+
+
+def test_request_without_server(tmpdir):
+    assert client.request(str(tmpdir.join('missing.sock')), ['doc.rst']) is None
+
+
+def test_request_without_answer(tmpdir):
+    socket_path = str(tmpdir.join('flake8-rst.sock'))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(1)
+
+    def hang_up():
+        connection, _ = listener.accept()
+        client._receive(connection)
+        connection.close()
+
+    thread = threading.Thread(target=hang_up)
+    thread.daemon = True
+    thread.start()
+    try:
+        assert client.request(socket_path, ['doc.rst']) is None
+    finally:
+        thread.join(1)
+        listener.close()
+
+
+def start_server(tmpdir, application):
+    socket_path = str(tmpdir.join('flake8-rst.sock'))
+    app = application(['--no-cache', '--socket', socket_path])
+    thread = threading.Thread(target=Server(app).serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        thread.join(0.05)
+    return socket_path, thread
+
+
+def test_server_answers_requests(tmpdir, application):
+    socket_path, _ = start_server(tmpdir, application)
+    document = tmpdir.join('doc.rst')
+    document.write('.. code-block:: python\n\n    import os\n')
+
+    expected = "{}:3:5: F401 'os' imported but unused\n".format(document)
+
+    assert client.request(socket_path, [str(document)]) == (expected, 1)
+
+    document.write('.. code-block:: python\n\n    import os\n    os.getcwd()\n')
+
+    assert client.request(socket_path, [str(document)]) == ('', 0)
+
+
+def test_server_survives_probes_and_bad_requests(tmpdir, application):
+    socket_path, thread = start_server(tmpdir, application)
+    document = tmpdir.join('doc.rst')
+    document.write('.. code-block:: python\n\n    import os\n    os.getcwd()\n')
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.connect(socket_path)
+    probe.close()
+
+    bad = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    bad.connect(socket_path)
+    bad.sendall(b'{not json')
+    bad.shutdown(socket.SHUT_WR)
+    response = json.loads(client._receive(bad).decode('utf-8'))
+    bad.close()
+
+    assert response['exit_code'] == 1
+    assert thread.is_alive()
+    assert client.request(socket_path, [str(document)]) == ('', 0)
@@ -1,14 +1,20 @@
+import bisect
 import doctest
 import optparse
+import pickle
 import pytest
+import sys
 
 try:
     import pathlib
 except ImportError:
     import pathlib2 as pathlib
 
-from flake8_rst.rst import RST_RE, apply_default_groupnames, apply_directive_specific_options, merge_by_group
-from flake8_rst.sourceblock import SourceBlock, _extract_roles
+from flake8_rst.rst import (DOCSTRING_SCANNER, RST_RE, RST_SCANNER, apply_default_groupnames,
+                            apply_directive_specific_options, find_sourcecode, merge_by_group)
+from flake8_rst import sourceblock
+from flake8_rst.sourceblock import (BlockGroup, SourceBlock, SourceLines, TransformMemo, _extract_roles,
+                                    _newline_offsets, ignored_lines_re)
 from hypothesis import assume, given, note, example
 from hypothesis import strategies as st
 
@@ -52,6 +58,50 @@ def test_find_block():
         assert block.source_block == origin_code
 
 
+@given(code_strategy, st.integers(min_value=0))
+def test_newline_offsets(src, position):
+    position = position % (len(src) + 1)
+
+    assert bisect.bisect_left(_newline_offsets(src), position) == src[:position].count('\n')
+
+
+rst_line_strategy = st.sampled_from([
+    '', '.. code-block:: python', '  .. code-block:: python', '.. ipython::', '.. sourcecode:: pycon',
+    '.. code-block:: bash', '   :flake8-group: A', ':flake8-group: A', '     :flake8-set-ignore: E1', '  :: :',
+    '   x = 1', '    y', '      z', '   ', 'text', '  text',
+])
+
+
+@given(st.lists(rst_line_strategy), st.sampled_from(['', '\n']))
+def test_directive_scanner(lines, end):
+    src = '\n'.join(lines) + end
+    groups = ('before', 'directive', 'language', 'roles', 'code')
+
+    expected = [(match.start(), [match.group(group) for group in groups]) for match in RST_RE.finditer(src)]
+    result = [(match.start(), [match.group(group) for group in groups]) for match in RST_SCANNER.finditer(src)]
+
+    assert result == expected
+
+
+@pytest.mark.parametrize('src, expected', [
+    ('"""\nModule.\n"""\nx = 1\n', ['"""\nModule.\n"""\n']),
+    ("def f():\n    r'''Doc.\n\n    >>> f()\n    '''\n", ["    r'''Doc.\n\n    >>> f()\n    '''\n"]),
+    ('class A(B):\n    # comment\n    u"Doc."\n', ['    u"Doc."\n']),
+    ('def f(x: "y" = {1: 2}) -> "z":\n    """Doc."""', ['    """Doc."""']),
+    ('x = """\nNot a docstring.\n"""\n', []),
+    ('def f():\n    """Not""" + "a docstring"\n', []),
+    ('def f():\n    b"""Not a docstring."""\n', []),
+])
+def test_docstring_scanner(src, expected):
+    assert [match.group('code') for match in DOCSTRING_SCANNER.finditer(src)] == expected
+
+
+def test_docstring_scanner_fallback():
+    src = 'def f(:\n    """\n    Doc.\n    """\n    (\n'
+
+    assert [match.group('code') for match in DOCSTRING_SCANNER.finditer(src)] == ['    """\n    Doc.\n    """']
+
+
 def test_clean_doctest():
     example = DATA_DIR / 'example_1.rst'
     src = example.open().read()
@@ -103,6 +153,53 @@ def test_clean_console_syntax(src, expected):
     assert block.source_block == expected
 
 
+@pytest.mark.parametrize('src, expected', [
+    ('x = 1\nif x != 2:\n    print("100%")\n', 0),
+    ('x = 1', 0),
+    ('%timeit x = 1\n', 1),
+    ('files = !ls\n', 1),
+    ('x?\n', 1),
+])
+def test_console_syntax_prescan(mocker, src, expected):
+    get_ipython_transform = mocker.patch('flake8_rst.sourceblock.get_ipython_transform', return_value=(None, None))
+    block = SourceBlock.from_source('', src)
+
+    block.clean_console_syntax()
+
+    assert get_ipython_transform.call_count == expected
+
+
+def test_transform_memo(mocker):
+    store = {}
+    memo = TransformMemo(max_size=1)
+    memo.store = mocker.Mock(get=store.get, set=store.__setitem__)
+    mocker.patch('flake8_rst.sourceblock.transform_memo', memo)
+    get_ipython_transform = mocker.spy(sourceblock, 'get_ipython_transform')
+
+    for _ in range(2):
+        block = SourceBlock.from_source('', '%time x = 1\n')
+        block.clean_console_syntax()
+        assert block.source_block == 'x = 1\n'
+    assert get_ipython_transform.call_count == 1
+
+    memo.set('y = 2\n', 'y = 2\n')
+    memo._cells.clear()
+
+    assert memo.get('%time x = 1\n') == 'x = 1\n'
+    assert len(store) == 2
+
+
+def test_ipython_version_without_importing_ipython(monkeypatch):
+    import importlib
+    expected = sourceblock._ipython_version()
+    # Like Python < 3.8 without the backport, importing IPython would fail.
+    monkeypatch.delattr(importlib, 'metadata', raising=False)
+    for name in ('importlib.metadata', 'importlib_metadata', 'IPython'):
+        monkeypatch.setitem(sys.modules, name, None)
+
+    assert sourceblock._ipython_version() == expected
+
+
 @pytest.mark.parametrize('src', [
     '%prun -l 4 f(x)\n',
     '%%timeit x = range(10000)\nmax(x)\n',
@@ -119,13 +216,56 @@ def test_ignore_unrecognized_console_syntax(src):
 @pytest.mark.parametrize('src, expected', [
     ('@okexcept\na = (1, 2,name)\n', 'a = (1, 2,name)\n'),
     ('@savefig "picture.png"\na = (1, 2,name)\nb = (3, 4, other)\n', 'a = (1, 2,name)\nb = (3, 4, other)\n'),
+    ('@verbatim\n@doctest\na = 1\n@okwarning\n@okexcept\n', 'a = 1\n'),
 ])
 def test_clean_ignored_lines(src, expected):
-    block = SourceBlock.from_source('', src)
+    block = SourceBlock.from_source('', src, start_line=3)
 
     block.clean_ignored_lines()
 
     assert block.source_block == expected
+    assert list(block.source_lines.linenos) == [3 + src.splitlines(True).index(line)
+                                                for line in expected.splitlines(True)]
+
+
+def test_clean_extra_ignored_lines():
+    block = SourceBlock.from_source('', '.. plot::\na = 1\n#: doctest: +SKIP\n@verbatim\n')
+
+    block.clean_ignored_lines(ignored_lines_re('\\.\\. plot::\n  #: doctest:\n'))
+
+    assert block.source_block == 'a = 1\n'
+
+
+@pytest.mark.parametrize('patterns', ['(', '\\.\\. plot::\n(?i)plot::'])
+def test_invalid_ignored_lines_regex(application, patterns):
+    from flake8 import exceptions
+
+    with pytest.raises(exceptions.ExecutionError):
+        application(['--no-cache', '--ignored-lines-regex', patterns])
+
+
+def test_source_lines():
+    lines = [(1, 'a\n', '  a\n'), (2, 'b\n', '  b\n'), (4, 'c\n', '  c\n')]
+    source_lines = SourceLines(lines)
+
+    assert list(source_lines) == lines
+    assert source_lines[1] == lines[1]
+    assert list(source_lines[1:]) == lines[1:]
+    assert list(SourceLines.concat([source_lines[:1], source_lines[2:]])) == [lines[0], lines[2]]
+    assert pickle.loads(pickle.dumps(source_lines)) == source_lines
+
+
+def test_cleaning_refreshes_cached_blocks():
+    block = SourceBlock.from_source('import os', '>>> x = 1\n@savefig "picture.png"\n')
+
+    assert block.complete_block == 'import os\n>>> x = 1\n@savefig "picture.png"\n'
+    assert block.get_code_line(2)['source'] == '>>> x = 1\n'
+
+    block.clean()
+
+    assert block.complete_block == 'import os\nx = 1\n'
+    assert block.source_block == 'x = 1\n'
+    assert block.get_code_line(2)['source'] == 'x = 1\n'
 
 
 @given(code_strategy, code_strategy, code_strategy)
@@ -194,6 +334,34 @@ def test_merge_by_group(group_names, expected):
     assert result == expected
 
 
+def test_block_group_out_of_order():
+    first = SourceBlock([], [(1, 'a = 1\n', 'a = 1\n')], roles={'group': 'A', 'add-ignore': 'F'})
+    second = SourceBlock([], [(5, 'b = 2\n', 'b = 2\n')], roles={'group': 'A'})
+    group = BlockGroup(second)
+    group.add(first)
+    merged = group.merged()
+
+    assert merged.source_block == 'a = 1\nb = 2\n'
+    assert merged.roles is first.roles
+    assert BlockGroup(first).merged() is first
+
+
+@pytest.mark.parametrize("changed_lines, expected", [
+    (None, ['\nimport os\n', '\nimport re\n\nx = 1\n']),
+    ({4}, ['\nimport os\n']),
+    ({12}, ['\nimport re\n\nx = 1\n']),
+    ({1, 6, 10}, []),
+])
+def test_select_changed_blocks(changed_lines, expected):
+    src = ('.. code-block:: python\n    :flake8-group: None\n\n    import os\n\n'
+           '.. code-block:: python\n\n    import re\n\n'
+           '.. code-block:: python\n\n    x = 1\n')
+    options = optparse.Values(dict(bootstrap=None, default_groupnames='*.rst->*: default', directive_scanner='regex'))
+    blocks = find_sourcecode('test.rst', options, src, changed_lines=changed_lines)
+
+    assert [block.source_block for block in blocks] == expected
+
+
 @given(code_strategy, code_strategy, st.lists(code_strategy, min_size=1))
 def test_inject_bootstrap_blocks(bootstrap, src, injected_bootstrap):
     note(injected_bootstrap)
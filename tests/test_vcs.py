@@ -0,0 +1,44 @@
+import subprocess
+
+import pytest
+from flake8 import exceptions
+
+from flake8_rst.vcs import changed_lines_since
+
+
+def git(*args):
+    subprocess.check_call(('git', '-c', 'user.name=flake8-rst', '-c', 'user.email=flake8-rst@example.com') + args)
+
+
+@pytest.fixture()
+def repository(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    git('init', '-q')
+    tmpdir.join('doc.rst').write('.. code-block:: python\n\n    import os\n\n    import sys\n')
+    tmpdir.join('readme.md').write('Readme\n')
+    git('add', '.')
+    git('commit', '-q', '-m', 'Initial commit')
+    return tmpdir
+
+
+def test_changed_lines_since(repository):
+    repository.join('doc.rst').write('.. code-block:: python\n\n    import os\n\n    import re\n')
+    repository.join('readme.md').write('Changed\n')
+    repository.join('new.py').write('x = 1\n')
+
+    assert changed_lines_since('HEAD', ['*.rst', '*.py']) == {'doc.rst': {4, 5}, 'new.py': None}
+    assert changed_lines_since('HEAD', ['*.rst']) == {'doc.rst': {4, 5}}
+
+
+def test_unknown_ref(repository):
+    with pytest.raises(exceptions.ExecutionError):
+        changed_lines_since('unknown', ['*.rst'])
+
+
+def test_since_checks_files_like_a_complete_run(repository, application):
+    repository.join('doc.rst').write('.. code-block:: python\n\n    import re\n')
+    repository.join('mod.py').write('import re\n')
+
+    app = application(['--no-cache', '--filename=*.rst', '--since', 'HEAD'])
+
+    assert sorted(app.file_checker_manager.changed_lines) == ['doc.rst']